@@ -0,0 +1,141 @@
+# cttm_context_packer.py - Token-budgeted RAG context packing with near-duplicate suppression and MMR
+import os
+import re
+import zlib
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from cttm_myanmar import has_myanmar, words_and_syllables
+from dhammi_history import estimate_tokens
+
+# ----------------------------- 1. CONFIGURATION -----------------------------
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("DHAMMI_CONTEXT_TOKENS", "600"))  # all fact lines together
+CONTEXT_MAX_FACTS = 6
+MAX_FACT_TOKENS = 160          # a single long fact is truncated to this
+PACK_CANDIDATES = 20           # retrieval depth the packer chooses from
+MMR_LAMBDA = 0.7               # 1.0 = pure relevance, 0.0 = pure diversity
+
+# MinHash over word 3-shingles; 16 bands x 4 rows puts the LSH threshold near 0.5,
+# and candidates sharing a band are confirmed against NEAR_DUPLICATE_JACCARD.
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+SHINGLE_SIZE = 3
+NEAR_DUPLICATE_JACCARD = 0.8
+
+SIGNATURE_KEY = "_minhash"     # stored on index records at ingest
+LSH_KEY = "_lsh_bands"
+
+_PRIME = np.uint64(4294967311)  # smallest prime above 2**32
+_rng = np.random.RandomState(20201108)
+_HASH_A = _rng.randint(1, 2 ** 31 - 1, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+_HASH_B = _rng.randint(0, 2 ** 31 - 1, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+# ----------------------------- 2. MINHASH / LSH -----------------------------
+def shingles(text: str) -> List[str]:
+    # Numbers are kept: two ward results that differ only in their counts are distinct facts.
+    text = str(text or "")
+    if text.isascii() or not has_myanmar(text):
+        words = _WORD_PATTERN.findall(text.lower())
+    else:
+        words = words_and_syllables(text)
+    if len(words) <= SHINGLE_SIZE:
+        return [" ".join(words)] if words else []
+    return [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """MINHASH_PERMUTATIONS-long MinHash signature of the text's word shingles."""
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in set(shingles(text))), dtype=np.uint64)
+    if hashes.size == 0:
+        return np.full(MINHASH_PERMUTATIONS, np.iinfo(np.uint64).max, dtype=np.uint64)
+    return ((_HASH_A[:, None] * hashes[None, :] + _HASH_B[:, None]) % _PRIME).min(axis=1)
+
+
+def lsh_bands(signature: np.ndarray) -> Tuple[int, ...]:
+    """One bucket key per band; near-duplicates collide in at least one band."""
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    return tuple(zlib.crc32(signature[b * rows:(b + 1) * rows].tobytes()) for b in range(LSH_BANDS))
+
+
+def annotate_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Attaches the MinHash signature and LSH band keys.
+
+    Done lazily, for the few candidates that reach the packer; the keys stay on
+    the (indexed) record, so each fact is hashed at most once.
+    """
+    if SIGNATURE_KEY not in record:
+        signature = minhash_signature(record.get("Fact_Text", ""))
+        record[SIGNATURE_KEY] = signature
+        record[LSH_KEY] = lsh_bands(signature)
+    return record
+
+
+def jaccard_estimate(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.mean(a == b))
+
+
+def is_near_duplicate(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    if not set(a[LSH_KEY]).intersection(b[LSH_KEY]):
+        return False
+    return jaccard_estimate(a[SIGNATURE_KEY], b[SIGNATURE_KEY]) >= NEAR_DUPLICATE_JACCARD
+
+
+# ----------------------------- 3. PACKING -----------------------------
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """Cuts text at a word boundary so it fits the token budget."""
+    if estimate_tokens(text) <= budget:
+        return text
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(" ".join(words[:mid]) + " …") <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return " ".join(words[:low]) + " …"
+
+
+def pack_context(candidates: Sequence[Tuple[Dict[str, Any], float]],
+                 token_budget: int = CONTEXT_TOKEN_BUDGET, max_facts: int = CONTEXT_MAX_FACTS,
+                 mmr_lambda: float = MMR_LAMBDA) -> List[Tuple[Dict[str, Any], float]]:
+    """Chooses facts for the prompt from ranked (record, score) candidates.
+
+    Near-duplicates of a better-ranked candidate are dropped, the rest are picked
+    by maximal marginal relevance, and facts are added while they fit the token
+    budget. Returned records are copies whose Fact_Text may be truncated.
+    """
+    pool: List[Tuple[Dict[str, Any], float]] = []
+    for record, score in candidates:
+        annotate_record(record)  # no-op once the fact has been packed before
+        if not any(is_near_duplicate(record, kept) for kept, _ in pool):
+            pool.append((record, score))
+    if not pool:
+        return []
+
+    top = max(score for _, score in pool) or 1.0
+    relevance = [max(0.0, score) / top for _, score in pool]
+    selected: List[int] = []
+    remaining = list(range(len(pool)))
+    used_tokens = 0
+    packed = []
+    while remaining and len(packed) < max_facts:
+        def mmr(i: int) -> float:
+            redundancy = max((jaccard_estimate(pool[i][0][SIGNATURE_KEY], pool[j][0][SIGNATURE_KEY])
+                              for j in selected), default=0.0)
+            return mmr_lambda * relevance[i] - (1 - mmr_lambda) * redundancy
+
+        best = max(remaining, key=mmr)
+        remaining.remove(best)
+        record, score = pool[best]
+        text = truncate_to_tokens(str(record.get("Fact_Text", "")), MAX_FACT_TOKENS)
+        cost = estimate_tokens(text) + 8  # "- Fact (V-Score x.xx): " prefix
+        if used_tokens + cost > token_budget:
+            continue  # a shorter, lower-ranked fact may still fit
+        used_tokens += cost
+        selected.append(best)
+        packed.append(({**record, "Fact_Text": text}, score))
+    return packed
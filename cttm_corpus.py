@@ -0,0 +1,196 @@
+# cttm_corpus.py - One structured retrieval corpus over the Sheets ledger, JSON facts and Junos intelligence
+import hashlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from cttm_retrieval import ledger_version
+from cttm_sync import compact_ledger_dtypes
+from dhammi_answer_cache import fingerprint
+
+# ----------------------------- 1. CONFIGURATION -----------------------------
+CORPUS_COLUMNS = ["Timestamp", "Category", "Confidence", "Fact_Text", "Source", "Source_Type"]
+
+SOURCE_LEDGER = "ledger"        # CTTM_Facts worksheet (via LedgerSync)
+SOURCE_KNOWLEDGE = "knowledge"  # ESSENTIAL_FACTS + journal facts (cttm_knowledge)
+SOURCE_JUNOS = "junos"          # CTTM-J actionable intelligence (cttm_sheets_reader)
+
+# ESSENTIAL_FACTS are the Political Paññā Lock; scraped headlines are unverified.
+ESSENTIAL_CONFIDENCE = 1.0
+KNOWLEDGE_CONFIDENCE = 0.5
+
+# Reciprocal-rank fusion constant and how many candidates to pull per requested fact.
+RRF_K = 60
+FUSION_CANDIDATES = 8
+
+
+# ----------------------------- 2. SOURCE ADAPTERS (vectorized) -----------------------------
+def ledger_records(df: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """Ledger rows as corpus records."""
+    if df is None or df.empty:
+        return pd.DataFrame(columns=CORPUS_COLUMNS)
+    out = df.reindex(columns=CORPUS_COLUMNS[:-1])
+    return out.assign(Source_Type=SOURCE_LEDGER)
+
+
+def knowledge_records(facts: Optional[Dict[str, Any]], essential_keys=()) -> pd.DataFrame:
+    """One record per fact line; headline blocks are split and attributed to their source."""
+    if not facts:
+        return pd.DataFrame(columns=CORPUS_COLUMNS)
+    values = pd.Series({k: v for k, v in facts.items() if isinstance(v, str)}, dtype=object)
+    lines = values.str.split("\n").explode().str.strip()
+    lines = lines[lines.str.len() > 0]
+
+    # Headline blocks are "Source: Name (Accessed: ts)" followed by "- headline" lines.
+    header = lines.str.extract(r"^Source: (?P<Source>[^(]+?)\s*(?:\(Accessed: (?P<Timestamp>[^)]*)\))?$")
+    is_header = header["Source"].notna()
+    key = pd.Series(lines.index, index=lines.index)
+    header = header.groupby(key.values).ffill()
+
+    text = lines.str.replace(r"^-\s*", "", regex=True)
+    keep = ~is_header & ~text.str.startswith("[") & ~text.str.contains("Connection Error|Parse Error")
+    essential = key.isin(set(essential_keys))
+    out = pd.DataFrame({
+        "Timestamp": header["Timestamp"].fillna(""),
+        "Category": key,
+        "Confidence": essential.map({True: ESSENTIAL_CONFIDENCE, False: KNOWLEDGE_CONFIDENCE}),
+        "Fact_Text": text,
+        "Source": header["Source"].fillna("cttm_knowledge"),
+        "Source_Type": SOURCE_KNOWLEDGE,
+    })[keep.values]
+    return out.reset_index(drop=True)
+
+
+def junos_records(data: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """Junos-tagged, not fully confirmed reports from the Form Responses sheet (no iterrows)."""
+    if data is None or data.empty:
+        return pd.DataFrame(columns=CORPUS_COLUMNS)
+    data = data.iloc[:, :4].copy()
+    data.columns = ["Timestamp", "Intelligence_Report", "Confidence_Level", "Junos_Tag"]
+    level = data["Confidence_Level"].astype(str)
+    tagged = data["Junos_Tag"].astype(str).str.upper().isin(["TRUE", "YES", "1"])
+    selected = data[tagged & ~level.str.contains("100%", na=False)]
+    percent = level[selected.index].str.extract(r"(\d+(?:\.\d+)?)\s*%")[0]
+    return pd.DataFrame({
+        "Timestamp": selected["Timestamp"].astype(str),
+        "Category": "Junos Intelligence",
+        "Confidence": pd.to_numeric(percent, errors="coerce").fillna(0.0) / 100.0,
+        "Fact_Text": selected["Intelligence_Report"].astype(str),
+        "Source": "CTTM-J",
+        "Source_Type": SOURCE_JUNOS,
+    }).reset_index(drop=True)
+
+
+# ----------------------------- 3. CORPUS -----------------------------
+def frame_version(df: Optional[pd.DataFrame]) -> str:
+    """Content hash of an arbitrary source frame (any columns)."""
+    if df is None or df.empty:
+        return "empty"
+    row_hashes = pd.util.hash_pandas_object(df.astype(str), index=False)
+    return hashlib.sha1(row_hashes.values.tobytes()).hexdigest()[:16]
+
+
+def cheap_frame_version(df: Optional[pd.DataFrame]) -> str:
+    """Row count plus last first-column value: enough for append-only sheets, no hashing."""
+    if df is None or df.empty:
+        return "empty"
+    return f"{len(df)}:{df.iloc[-1, 0]}"
+
+
+def build_corpus(parts: Dict[str, pd.DataFrame], version: str) -> pd.DataFrame:
+    frames = [p for p in parts.values() if p is not None and not p.empty]
+    if not frames:
+        corpus = pd.DataFrame(columns=CORPUS_COLUMNS)
+    else:
+        corpus = pd.concat(frames, ignore_index=True)
+    corpus["Confidence"] = pd.to_numeric(corpus["Confidence"], errors="coerce").fillna(0.0)
+    corpus = compact_ledger_dtypes(corpus.sort_values(by="Confidence", ascending=False, kind="stable"))
+    corpus.attrs["ledger_version"] = version
+    return corpus
+
+
+class CorpusBuilder:
+    """Callable ledger loader that merges every fact source into one corpus frame.
+
+    The merged frame is rebuilt only when one of the source versions changes, so
+    the pipeline still sees a stable version (and the BM25 index stays warm).
+    knowledge_version (e.g. cttm_knowledge.cttm_facts_version) is polled each
+    call and the facts are re-read only when it moves; without it the facts are
+    fingerprinted. A Junos frame carrying attrs["junos_version"] is not hashed.
+    """
+
+    def __init__(self, ledger_loader: Callable[[], pd.DataFrame],
+                 knowledge_loader: Optional[Callable[[], Dict[str, Any]]] = None,
+                 junos_loader: Optional[Callable[[], pd.DataFrame]] = None,
+                 essential_keys=(),
+                 knowledge_version: Optional[Callable[[], Any]] = None):
+        self.ledger_loader = ledger_loader
+        self.knowledge_loader = knowledge_loader
+        self.knowledge_version = knowledge_version
+        self.junos_loader = junos_loader
+        self.essential_keys = tuple(essential_keys)
+        self._key: Optional[Tuple[str, ...]] = None
+        self._corpus: Optional[pd.DataFrame] = None
+        self._knowledge: Tuple[Optional[str], pd.DataFrame] = (None, pd.DataFrame(columns=CORPUS_COLUMNS))
+
+    def _load_knowledge(self) -> Tuple[str, pd.DataFrame]:
+        if self.knowledge_loader is None:
+            return "none", self._knowledge[1]
+        if self.knowledge_version is not None:
+            version = f"v{self.knowledge_version()}"
+            if version != self._knowledge[0]:
+                self._knowledge = (version, knowledge_records(self.knowledge_loader() or {}, self.essential_keys))
+            return version, self._knowledge[1]
+        facts = self.knowledge_loader() or {}
+        version = fingerprint(sorted((k, str(v)) for k, v in facts.items()))
+        if version != self._knowledge[0]:
+            self._knowledge = (version, knowledge_records(facts, self.essential_keys))
+        return version, self._knowledge[1]
+
+    def __call__(self) -> pd.DataFrame:
+        ledger = self.ledger_loader()
+        ledger_v = (ledger.attrs.get("ledger_version") or ledger_version(ledger)) if ledger is not None else "empty"
+        knowledge_v, knowledge = self._load_knowledge()
+        # The Junos loader returns junos_records() output (cached upstream with the sheet read).
+        junos = self.junos_loader() if self.junos_loader is not None else None
+        junos_v = (junos.attrs.get("junos_version") or frame_version(junos)) if junos is not None else "none"
+
+        key = (ledger_v, knowledge_v, junos_v)
+        if key != self._key or self._corpus is None:
+            self._corpus = build_corpus({
+                SOURCE_LEDGER: ledger_records(ledger),
+                SOURCE_KNOWLEDGE: knowledge,
+                SOURCE_JUNOS: junos,
+            }, version=fingerprint(*key)[:16])
+            self._key = key
+        return self._corpus
+
+    @property
+    def version(self) -> Optional[str]:
+        """Version of the last corpus built, or None before the first call."""
+        return fingerprint(*self._key)[:16] if self._key is not None else None
+
+    def version_for(self, ledger_v: str) -> Optional[str]:
+        """The version the corpus will have when only the ledger moves to ledger_v."""
+        return fingerprint(ledger_v, *self._key[1:])[:16] if self._key is not None else None
+
+
+# ----------------------------- 4. SCORE FUSION -----------------------------
+def fuse_by_source(results: List[Tuple[Dict[str, Any], float]], k: int,
+                   rrf_k: int = RRF_K) -> List[Tuple[Dict[str, Any], float]]:
+    """Reciprocal-rank fusion of the overall ranking with each source's own ranking.
+
+    `results` is one ranked candidate list from a single corpus search. Each
+    candidate scores 1/(rrf_k + overall rank) + 1/(rrf_k + rank within its
+    source), so the best facts from every source surface even when one source's
+    raw scores run higher.
+    """
+    per_source_rank: Dict[str, int] = {}
+    fused = []
+    for overall_rank, (record, _score) in enumerate(results, start=1):
+        source = record.get("Source_Type") or SOURCE_LEDGER
+        per_source_rank[source] = per_source_rank.get(source, 0) + 1
+        score = 1.0 / (rrf_k + overall_rank) + 1.0 / (rrf_k + per_source_rank[source])
+        fused.append((record, score))
+    fused.sort(key=lambda item: item[1], reverse=True)
+    return fused[:k]
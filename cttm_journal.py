@@ -0,0 +1,176 @@
+# cttm_journal.py - Append-only, versioned journal for the CTTM JSON fact store
+import datetime
+import json
+import os
+import tempfile
+import threading
+from typing import Any, BinaryIO, Callable, Dict, Optional
+
+# ----------------------------- 1. CONFIGURATION -----------------------------
+# Journal records since the last compaction before the snapshot is rewritten.
+COMPACT_EVERY = 200
+
+
+def atomic_write(path: str, write: Callable[[BinaryIO], None], suffix: str = ".tmp"):
+    """Runs write(f) on a temp file next to path, then renames it into place.
+
+    Readers never see a partial file, and the temp file is removed if writing fails.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _atomic_write(path: str, text: str):
+    """Writes text to path via a temp file + rename so readers never see a partial file."""
+    atomic_write(path, lambda f: f.write(text.encode('utf-8')))
+
+
+# ----------------------------- 2. FACT JOURNAL -----------------------------
+class FactJournal:
+    """Latest-value-per-key store: a JSON snapshot plus an append-only JSONL journal.
+
+    Every write appends one {"v", "key", "value", "ts"} line. Readers keep a byte
+    offset and only parse lines appended since their last poll. Compaction folds
+    the journal into the snapshot and restarts it with a checkpoint line carrying
+    the current version, so the version counter never goes backwards.
+    Designed for a single writer process (cttm_updater) and any number of readers.
+    """
+
+    def __init__(self, snapshot_path: str, journal_path: Optional[str] = None,
+                 compact_every: int = COMPACT_EVERY):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or snapshot_path + ".journal"
+        self.compact_every = compact_every
+        self._lock = threading.RLock()
+        self._facts: Dict[str, Any] = {}
+        self._version = 0
+        self._records_since_compaction = 0
+        self._offset = 0
+        self._journal_id = None  # (st_dev, st_ino) of the journal we are tailing
+        self._loaded = False
+
+    # --- Reads ---
+    def _load_snapshot(self) -> Dict[str, Any]:
+        if not os.path.exists(self.snapshot_path):
+            return {}
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, json.JSONDecodeError):
+            print("Warning: CTTM JSON snapshot is corrupted. Rebuilding from the journal only.")
+            return {}
+
+    def _reload(self):
+        self._facts = self._load_snapshot()
+        self._version = 0
+        self._records_since_compaction = 0
+        self._offset = 0
+        self._journal_id = None
+        self._loaded = True
+
+    def _tail(self):
+        """Applies journal lines appended since the last poll."""
+        try:
+            stat = os.stat(self.journal_path)
+        except FileNotFoundError:
+            return
+        journal_id = (stat.st_dev, stat.st_ino)
+        if self._journal_id is not None and journal_id != self._journal_id:
+            # The writer compacted and swapped in a new journal: start over.
+            self._reload()
+        self._journal_id = journal_id
+        if stat.st_size <= self._offset:
+            return
+
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self._offset)
+            chunk = f.read()
+        # Only consume complete lines; a writer may be mid-append.
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self._version = max(self._version, int(record.get("v", 0)))
+            if "key" in record:
+                self._facts[record["key"]] = record.get("value")
+                self._records_since_compaction += 1
+        self._offset += end
+
+    def poll(self) -> int:
+        """Picks up new journal records (cheap stat + tail read) and returns the version."""
+        with self._lock:
+            if not self._loaded:
+                self._reload()
+            self._tail()
+            return self._version
+
+    @property
+    def version(self) -> int:
+        return self.poll()
+
+    def latest(self) -> Dict[str, Any]:
+        """Returns a copy of the latest value for every key."""
+        with self._lock:
+            self.poll()
+            return dict(self._facts)
+
+    # --- Writes ---
+    def put(self, key: str, value: Any) -> int:
+        """Appends a new value for key. Returns the new version."""
+        return self.put_many({key: value})
+
+    def put_many(self, updates: Dict[str, Any]) -> int:
+        """Appends one journal record per changed key. Returns the new version."""
+        with self._lock:
+            self.poll()
+            changed = {k: v for k, v in updates.items() if self._facts.get(k) != v or k not in self._facts}
+            if not changed:
+                return self._version
+            ts = datetime.datetime.now().isoformat(timespec="seconds")
+            lines = []
+            for key, value in changed.items():
+                self._version += 1
+                lines.append(json.dumps({"v": self._version, "key": key, "value": value, "ts": ts},
+                                        ensure_ascii=False))
+            payload = ("\n".join(lines) + "\n").encode("utf-8")
+            with open(self.journal_path, 'ab') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            # Our own append is already applied in memory; skip it when tailing.
+            self._facts.update(changed)
+            self._records_since_compaction += len(changed)
+            self._offset += len(payload)
+            stat = os.stat(self.journal_path)
+            self._journal_id = (stat.st_dev, stat.st_ino)
+
+            if self._records_since_compaction >= self.compact_every:
+                self.compact()
+            return self._version
+
+    def compact(self):
+        """Folds the journal into the snapshot. Safe to interrupt at any point."""
+        with self._lock:
+            self.poll()
+            # 1. New snapshot first; replaying the old journal over it is idempotent.
+            _atomic_write(self.snapshot_path, json.dumps(self._facts, indent=4, ensure_ascii=False))
+            # 2. Then restart the journal from a checkpoint at the current version.
+            checkpoint = json.dumps({"v": self._version, "checkpoint": True}) + "\n"
+            _atomic_write(self.journal_path, checkpoint)
+            stat = os.stat(self.journal_path)
+            self._journal_id = (stat.st_dev, stat.st_ino)
+            self._offset = len(checkpoint.encode("utf-8"))
+            self._records_since_compaction = 0
@@ -1,6 +1,7 @@
-import json
-import os
-from typing import Dict, List, Any
+import threading
+from typing import Dict, List, Any, Optional
+
+from cttm_journal import FactJournal
 
 # Define the file path for the CTTM database
 CTTM_FILE_PATH = "dhammi_cttm_facts.json"
@@ -56,31 +57,43 @@ RAG_KEYWORDS: Dict[str, List[str]] = {
 
 # 3. CTTM DATABASE MANAGEMENT FUNCTIONS
 # These functions allow Dhammi to read and write the facts file.
+# Writes go to an append-only journal next to the JSON file, which is only
+# rewritten (atomically) on compaction. Nothing touches the disk at import time.
+_journal: Optional[FactJournal] = None
+_journal_lock = threading.Lock()
+
+
+def get_fact_journal() -> FactJournal:
+    """Returns the process-wide fact journal, created on first use."""
+    global _journal
+    if _journal is None:
+        with _journal_lock:
+            if _journal is None:
+                _journal = FactJournal(CTTM_FILE_PATH)
+    return _journal
+
+
 def load_cttm_facts() -> Dict[str, Any]:
-    """Loads the current CTTM facts from the JSON file."""
-    if not os.path.exists(CTTM_FILE_PATH):
-        # If the file doesn't exist, create it with the essential facts
-        save_cttm_facts(ESSENTIAL_FACTS)
-        return ESSENTIAL_FACTS
-    
-    try:
-        with open(CTTM_FILE_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        print("Warning: CTTM JSON file is corrupted. Resetting to essential facts.")
-        save_cttm_facts(ESSENTIAL_FACTS)
-        return ESSENTIAL_FACTS
+    """Returns the latest CTTM facts, with ESSENTIAL_FACTS as defaults for missing keys."""
+    return {**ESSENTIAL_FACTS, **get_fact_journal().latest()}
+
+
+def cttm_facts_version() -> int:
+    """Monotonic version of the fact store; poll this instead of re-reading the facts."""
+    return get_fact_journal().poll()
+
+
+def put_cttm_fact(key: str, value: Any) -> int:
+    """Records a new value for one fact. Returns the new version."""
+    return get_fact_journal().put(key, value)
 
-def save_cttm_facts(facts_data: Dict[str, Any]):
-    """Saves the CTTM facts (including daily updates) to the JSON file."""
-    with open(CTTM_FILE_PATH, 'w', encoding='utf-8') as f:
-        # Use indent=4 for human readability, making it easy for you to check
-        json.dump(facts_data, f, indent=4, ensure_ascii=False)
 
+def save_cttm_facts(facts_data: Dict[str, Any]) -> int:
+    """Records every changed key in facts_data (including daily updates). Returns the new version."""
+    return get_fact_journal().put_many(facts_data)
 
-# Initialize the database file when the script is imported
-load_cttm_facts()
 
 # Now, DHAMMI can import and use:
 # 1. RAG_KEYWORDS (For expanding searches)
 # 2. load_cttm_facts() (For getting the latest truth)
+# 3. cttm_facts_version() (For cheap change detection)
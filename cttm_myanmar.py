@@ -0,0 +1,82 @@
+# cttm_myanmar.py - Myanmar-script syllable segmentation and n-gram terms for retrieval
+import re
+from typing import List
+
+# ----------------------------- 1. SCRIPT TABLES -----------------------------
+# Myanmar block plus Extended-A/B; digits and the section marks ၊ ။ are handled separately.
+MYANMAR_CHAR = re.compile(r"[\u1000-\u109F\uA9E0-\uA9FF\uAA60-\uAA7F]")
+MYANMAR_RUN = re.compile(r"[\u1000-\u103F\u104C-\u109F\uA9E0-\uA9FF\uAA60-\uAA7F]+")
+
+# Myanmar digits read as ASCII, so "၂၀၂၀" and "2020" are the same term.
+MYANMAR_DIGITS = str.maketrans("၀၁၂၃၄၅၆၇၈၉", "0123456789")
+
+# A syllable starts at a consonant that is neither stacked under the previous one
+# (preceded by the virama ္ U+1039) nor itself killed or stacking (followed by the
+# asat ် U+103A or ္), and at every independent vowel or symbol.
+SYLLABLE_START = re.compile(
+    r"(?<!\u1039)[\u1000-\u1021](?![\u103A\u1039])"
+    r"|[\u1023-\u1027\u1029\u102A\u103F\u104C-\u104F]"
+)
+
+# Words of spaced scripts never absorb adjacent Myanmar letters (which \w also matches).
+MIXED_WORD = re.compile(r"(" + MYANMAR_RUN.pattern + r")|[^\W\u1000-\u109F\uA9E0-\uA9FF\uAA60-\uAA7F]+")
+
+SYLLABLE_NGRAM = 2  # syllable unigrams plus bigrams (bigrams approximate words)
+
+
+# ----------------------------- 2. SEGMENTATION -----------------------------
+def has_myanmar(text: str) -> bool:
+    return MYANMAR_CHAR.search(text) is not None
+
+
+def segment_syllables(run: str) -> List[str]:
+    """Splits a run of Myanmar script (no spaces, digits or punctuation) into syllables."""
+    starts = [m.start() for m in SYLLABLE_START.finditer(run)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)  # leading medial/vowel sign: attach it to a syllable of its own
+    starts.append(len(run))
+    return [run[a:b] for a, b in zip(starts, starts[1:])]
+
+
+def syllable_terms(run: str, n: int = SYLLABLE_NGRAM) -> List[str]:
+    """Syllable unigrams and n-grams of one Myanmar run, interleaved in reading order.
+
+    Interleaving keeps a capped term list (e.g. query expansion) covering the
+    start of the text with both granularities.
+    """
+    syllables = segment_syllables(run)
+    terms: List[str] = []
+    for i, syllable in enumerate(syllables):
+        terms.append(syllable)
+        for size in range(2, n + 1):
+            if i + 1 >= size:
+                terms.append("".join(syllables[i + 1 - size:i + 1]))
+    return terms
+
+
+def mixed_script_terms(text: str, min_word_length: int = 3) -> List[str]:
+    """Index terms for lowercase text mixing Myanmar and spaced scripts.
+
+    Spaced-script words shorter than min_word_length are dropped, as in the
+    plain tokenizer; Myanmar runs contribute their syllable n-gram terms.
+    """
+    terms: List[str] = []
+    for match in MIXED_WORD.finditer(text.translate(MYANMAR_DIGITS)):
+        if match.group(1):
+            terms.extend(syllable_terms(match.group(1)))
+        elif len(match.group(0)) >= min_word_length:
+            terms.append(match.group(0))
+    return terms
+
+
+def words_and_syllables(text: str) -> List[str]:
+    """Lowercase words for spaced scripts and syllables for Myanmar runs (for shingling)."""
+    text = str(text or "").translate(MYANMAR_DIGITS).lower()
+    out: List[str] = []
+    for match in MIXED_WORD.finditer(text):
+        if match.group(1):
+            out.extend(segment_syllables(match.group(1)))
+        else:
+            out.append(match.group(0))
+    return out
+
@@ -0,0 +1,103 @@
+# cttm_query_expansion.py - Weighted query expansion from cttm_knowledge.RAG_KEYWORDS
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cttm_retrieval import tokenize
+
+# ----------------------------- 1. EXPANSION SETTINGS -----------------------------
+ORIGINAL_TERM_WEIGHT = 1.0
+VARIANT_TERM_WEIGHT = 0.8       # singular/plural forms of the user's own words
+EXPANSION_TERM_WEIGHT = 0.35    # terms pulled in from RAG_KEYWORDS phrases
+MAX_QUERY_TERMS = 32            # cap on the user's own terms
+MAX_TERMS_PER_TRIGGER = 12
+MAX_EXPANSION_TERMS = 24        # total fan-out added per query
+EXPANSION_MAX_DF_RATIO = 0.2    # expansion terms in more of the corpus than this only add noise
+
+# Extra words that should fire an existing RAG_KEYWORDS entry.
+KEYWORD_ALIASES: Dict[str, str] = {
+    "ethnic": "people",
+    "displaced": "refugee",
+    "idp": "refugee",
+    "poll": "election",
+    "vote": "election",
+}
+
+# Filler words in the expansion phrases that would only add noise to BM25, plus
+# terms found across the whole CTTM corpus.
+EXPANSION_STOPWORDS = {"all", "list", "data", "situation", "status", "report", "the", "and",
+                       "myanmar", "cross"}
+
+
+def stem(token: str) -> str:
+    """Light plural stemmer: refugees -> refugee, crosses -> cross, parties -> party."""
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 4 and token.endswith(("ses", "xes", "zes", "ches", "shes")):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        return token[:-1]
+    return token
+
+
+def inflections(word: str) -> List[str]:
+    """Surface forms that should map to the same trigger."""
+    base = stem(word)
+    forms = {word, base, base + "s"}
+    if base.endswith("y"):
+        forms.add(base[:-1] + "ies")
+    if base.endswith(("s", "x", "z", "ch", "sh")):
+        forms.add(base + "es")
+    return sorted(forms)
+
+
+# ----------------------------- 2. COMPILED EXPANDER -----------------------------
+class QueryExpander:
+    """Compiles a keyword -> phrases map once into a token trigger lookup table."""
+
+    def __init__(self, keyword_map: Dict[str, List[str]], aliases: Dict[str, str] = KEYWORD_ALIASES):
+        expansions: Dict[str, List[str]] = {}
+        for keyword, phrases in keyword_map.items():
+            terms: List[str] = []
+            for phrase in phrases:
+                for term in tokenize(phrase):
+                    if term not in EXPANSION_STOPWORDS and term not in terms:
+                        terms.append(term)
+            expansions[keyword.lower()] = terms[:MAX_TERMS_PER_TRIGGER]
+
+        # trigger surface form -> ordered expansion terms
+        self.triggers: Dict[str, Tuple[str, ...]] = {}
+        for keyword, terms in expansions.items():
+            for form in inflections(keyword):
+                self.triggers[form] = tuple(terms)
+        for alias, keyword in aliases.items():
+            if keyword in expansions:
+                for form in inflections(alias):
+                    self.triggers.setdefault(form, tuple(expansions[keyword]))
+
+    def expand(self, query: str,
+               document_frequency: Optional[Callable[[str], float]] = None) -> Dict[str, float]:
+        """Returns weighted search terms: the query's own words plus bounded expansions.
+
+        With document_frequency (e.g. CTTMIndex.document_frequency), expansion
+        terms found in more than EXPANSION_MAX_DF_RATIO of the corpus are skipped.
+        """
+        weights: Dict[str, float] = {}
+        tokens = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        for token in tokens:
+            weights[token] = ORIGINAL_TERM_WEIGHT
+        for token in tokens:
+            base = stem(token)
+            if base != token and base not in weights:
+                weights[base] = VARIANT_TERM_WEIGHT
+
+        added = 0
+        for token in tokens:
+            for term in self.triggers.get(token, ()):
+                if added >= MAX_EXPANSION_TERMS:
+                    return weights
+                if term in weights:
+                    continue
+                if document_frequency is not None and document_frequency(term) > EXPANSION_MAX_DF_RATIO:
+                    continue
+                weights[term] = EXPANSION_TERM_WEIGHT
+                added += 1
+        return weights
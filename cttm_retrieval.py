@@ -0,0 +1,281 @@
+# cttm_retrieval.py - Inverted-index (BM25) retrieval over the CTTM Ground Truth Ledger
+import hashlib
+import math
+import re
+import threading
+from array import array
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from cttm_myanmar import has_myanmar, mixed_script_terms
+from dhammi_metrics import METRICS
+
+# ----------------------------- 1. SCORING PARAMETERS -----------------------------
+# Standard Okapi BM25 constants. K1 controls term-frequency saturation,
+# B controls how strongly long facts are penalised against the average length.
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Share of the final score taken from the SS'ISM V-Score (Confidence column).
+# The remainder comes from the normalised BM25 relevance of the fact text.
+CONFIDENCE_WEIGHT = 0.3
+
+TOKEN_PATTERN = re.compile(r"\w{3,}")
+
+# Function words carry no retrieval signal and have the longest posting lists.
+INDEX_STOPWORDS = frozenset({
+    "the", "and", "for", "that", "this", "with", "from", "are", "was", "were", "has", "have",
+    "had", "not", "but", "what", "who", "whom", "how", "why", "when", "where", "which", "its",
+    "their", "they", "there", "about", "into", "than", "then", "them", "these", "those", "been",
+    "being", "will", "would", "can", "could", "should", "does", "did", "any", "our", "your",
+    "you", "his", "her", "she", "him", "also", "such", "very", "just", "over", "after",
+    "before", "tell", "please",
+})
+
+# Query terms found in more than this share of facts are skipped when the query
+# has more selective terms (their BM25 idf is near zero anyway).
+COMMON_TERM_DF_RATIO = 0.5
+
+# Share-of-max score levels tried, in order, to seed the top-k bound.
+TOP_K_SEED_LEVELS = (0.9, 0.6, 0.3)
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits text into lowercase word tokens of three or more characters.
+
+    Burmese is written without spaces between words, so Myanmar-script runs
+    become syllable unigrams and bigrams instead (see cttm_myanmar).
+    """
+    if not isinstance(text, str):
+        return []
+    text = text.lower()
+    if text.isascii() or not has_myanmar(text):
+        return TOKEN_PATTERN.findall(text)
+    return mixed_script_terms(text)
+
+
+def ledger_version(df: pd.DataFrame) -> str:
+    """Returns a short content fingerprint for a ledger DataFrame."""
+    if df is None or df.empty:
+        return "empty"
+    cols = [c for c in ("Timestamp", "Category", "Confidence", "Fact_Text", "Source") if c in df.columns]
+    row_hashes = pd.util.hash_pandas_object(df[cols], index=False)
+    return hashlib.sha1(row_hashes.values.tobytes()).hexdigest()[:16]
+
+
+# ----------------------------- 2. INVERTED INDEX -----------------------------
+class CTTMIndex:
+    """Token inverted index over ledger facts, ranked by BM25 blended with the V-Score.
+
+    Postings are appended as compact int32 arrays and frozen into numpy arrays
+    of precomputed BM25 term weights the first time a query touches the term,
+    so scoring a query is a few vectorised adds rather than a Python loop.
+    """
+
+    def __init__(self, version: str = "empty"):
+        self.version = version
+        # token -> (doc ids, term frequencies)
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.doc_lengths = array("i")
+        self.confidences = array("d")
+        self.records: List[Dict[str, Any]] = []
+        self._total_length = 0
+        # Frozen, query-ready views; dropped whenever documents are added
+        # because the average length (and so every length norm) moves.
+        self._lock = threading.Lock()
+        self._frozen: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._doc_arrays: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, version: Optional[str] = None) -> "CTTMIndex":
+        """Builds an index from a ledger DataFrame as returned by load_cttm_facts()."""
+        index = cls(version=version or ledger_version(df))
+        if df is not None and not df.empty:
+            index.add_records(df.to_dict("records"))
+        return index
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def avg_doc_length(self) -> float:
+        return self._total_length / len(self.doc_lengths) if self.doc_lengths else 0.0
+
+    def add_records(self, records: Iterable[Dict[str, Any]]):
+        """Appends ledger rows to the index without rebuilding existing postings."""
+        with self._lock:
+            for record in records:
+                doc_id = len(self.records)
+                tokens = [t for t in tokenize(record.get("Fact_Text", "")) if t not in INDEX_STOPWORDS]
+                counts: Dict[str, int] = defaultdict(int)
+                for token in tokens:
+                    counts[token] += 1
+                try:
+                    confidence = float(record.get("Confidence", 0.0) or 0.0)
+                except (TypeError, ValueError):
+                    confidence = 0.0
+                if math.isnan(confidence):
+                    confidence = 0.0
+                # The top-k bound in search() assumes V-Scores within [0, 1].
+                confidence = min(max(confidence, 0.0), 1.0)
+
+                self.records.append(record)
+                self.doc_lengths.append(len(tokens))
+                self.confidences.append(confidence)
+                self._total_length += len(tokens)
+                for token, tf in counts.items():
+                    posting = self.postings.get(token)
+                    if posting is None:
+                        posting = self.postings[token] = (array("i"), array("i"))
+                    posting[0].append(doc_id)
+                    posting[1].append(tf)
+            self._frozen.clear()
+            self._doc_arrays = None
+
+    def document_frequency(self, term: str) -> float:
+        """Share of indexed facts containing the term (0.0 - 1.0)."""
+        posting = self.postings.get(term)
+        return len(posting[0]) / len(self.records) if posting and self.records else 0.0
+
+    def _idf(self, doc_freq: int) -> float:
+        n_docs = len(self.records)
+        return math.log(1.0 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def _frozen_term(self, term: str, norms: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """(doc ids, BM25 tf weights) for one term; called with the lock held."""
+        frozen = self._frozen.get(term)
+        if frozen is None:
+            posting = self.postings.get(term)
+            if posting is None:
+                return None
+            doc_ids = np.frombuffer(posting[0], dtype=np.int32).copy()
+            tf = np.frombuffer(posting[1], dtype=np.int32).astype(np.float32)
+            frozen = (doc_ids, tf * (BM25_K1 + 1.0) / (tf + norms[doc_ids]))
+            self._frozen[term] = frozen
+        return frozen
+
+    def search(self, query: Union[str, Dict[str, float]], k: int = 3) -> List[Tuple[Dict[str, Any], float]]:
+        """Returns the top-k (record, score) pairs.
+
+        query is either free text or a {term: weight} map from query expansion.
+        """
+        if not self.records or k <= 0:
+            return []
+
+        if isinstance(query, str):
+            query_terms = {term: 1.0 for term in tokenize(query)}
+        else:
+            query_terms = query
+        query_terms = {t: w for t, w in query_terms.items() if t not in INDEX_STOPWORDS and t in self.postings}
+        # Terms in most facts barely move BM25 but cost the most to score; they are
+        # only used when nothing more selective is in the query.
+        selective = {t: w for t, w in query_terms.items() if self.document_frequency(t) <= COMMON_TERM_DF_RATIO}
+        query_terms = selective or query_terms
+        if not query_terms:
+            return []
+
+        with self._lock:
+            n_docs = len(self.records)
+            if self._doc_arrays is None:
+                lengths = np.frombuffer(self.doc_lengths, dtype=np.int32).astype(np.float32)
+                norms = BM25_K1 * (1.0 - BM25_B + BM25_B * lengths / (self.avg_doc_length or 1.0))
+                self._doc_arrays = (norms, np.frombuffer(self.confidences, dtype=np.float64).astype(np.float32))
+            norms, confidences = self._doc_arrays
+            terms = [(self._frozen_term(t, norms), w * self._idf(len(self.postings[t][0])))
+                     for t, w in query_terms.items()]
+
+        # Only the postings of the query terms are touched, never the whole ledger.
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for (doc_ids, weights), idf in terms:
+            np.add.at(scores, doc_ids, np.float32(idf) * weights)
+
+        # Exact top-k without blending every fact: the best-scoring facts give a lower
+        # bound on the k-th blended score, and a fact can only reach it if its raw
+        # score is at least (bound - CONFIDENCE_WEIGHT) / (1 - CONFIDENCE_WEIGHT) of the max.
+        # (Boolean masks, not argpartition: most of the ledger ties at zero.)
+        max_score = float(scores.max())
+        if max_score <= 0:
+            return []
+        confidence = np.float32(CONFIDENCE_WEIGHT)
+        relevance = np.float32((1.0 - CONFIDENCE_WEIGHT) / max_score)
+        for level in TOP_K_SEED_LEVELS:
+            seed = np.flatnonzero(scores >= max_score * level)
+            if seed.size >= k:
+                break
+        else:
+            seed = np.flatnonzero(scores > 0)
+        seed_blended = relevance * scores[seed] + confidence * confidences[seed]
+        bound = float(np.partition(seed_blended, -k)[-k]) if seed.size > k else float(seed_blended.min())
+        # (less a float32 rounding margin, so the seed facts themselves always qualify)
+        threshold = (bound - CONFIDENCE_WEIGHT) * max_score / (1.0 - CONFIDENCE_WEIGHT) - 1e-5 * max_score
+        candidates = np.flatnonzero(scores >= threshold) if threshold > 0 else np.flatnonzero(scores > 0)
+        blended = relevance * scores[candidates] + confidence * confidences[candidates]
+        top = np.argpartition(blended, -k)[-k:] if candidates.size > k else np.arange(candidates.size)
+        top = top[np.argsort(-blended[top], kind="stable")]
+        return [(self.records[int(candidates[i])], float(blended[i])) for i in top]
+
+
+# ----------------------------- 3. LIVE INDEX REGISTRY -----------------------------
+class IndexRegistry:
+    """Holds the live index so newly submitted rows can be added without a rebuild.
+
+    Only the first index is built on the caller's thread. A new version is built
+    in the background while the previous index keeps serving.
+    """
+
+    def __init__(self):
+        self._index: Optional[CTTMIndex] = None
+        self._wanted: Optional[str] = None
+        self._build: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def get(self, version: str, df: pd.DataFrame) -> CTTMIndex:
+        """Returns the index for this ledger version, or the previous one while it builds."""
+        index = self._index
+        if index is not None and index.version == version:
+            METRICS.record_cache("index", hit=True)
+            return index
+        with self._lock:
+            index = self._index
+            if index is None:
+                METRICS.record_cache("index", hit=False)
+                with METRICS.span("index_build", rows=len(df)):
+                    self._index = CTTMIndex.from_dataframe(df, version=version)
+                return self._index
+            if index.version == version:
+                return index
+            self._wanted = version
+            if self._build is None or not self._build.is_alive():
+                METRICS.record_cache("index", hit=False)
+                self._build = threading.Thread(target=self._build_index, args=(version, df),
+                                               name="cttm-index", daemon=True)
+                self._build.start()
+            return index
+
+    def _build_index(self, version: str, df: pd.DataFrame):
+        try:
+            with METRICS.span("index_build", rows=len(df)):
+                index = CTTMIndex.from_dataframe(df, version=version)
+        except Exception as e:
+            print(f"RAG Warning: index build failed: {e}")
+            return
+        with self._lock:
+            # extend() may already have brought the live index to the wanted version.
+            if self._index is None or self._index.version != self._wanted:
+                self._index = index
+
+    def wait(self, timeout: Optional[float] = None):
+        """Blocks until a background build (if any) finishes; for scripts and benchmarks."""
+        build = self._build
+        if build is not None:
+            build.join(timeout)
+
+    def extend(self, from_version: str, to_version: str, records: List[Dict[str, Any]]):
+        """Appends records to the live index if it is at from_version; otherwise the next get() rebuilds."""
+        with self._lock:
+            if self._index is not None and self._index.version == from_version:
+                self._index.add_records(records)
+                self._index.version = to_version
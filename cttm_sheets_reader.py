@@ -3,6 +3,8 @@ import pandas as pd
 from streamlit_gsheets import GSheetsConnection
 import datetime
 
+from cttm_corpus import cheap_frame_version, junos_records
+
 # --- CONFIGURATION ---
 # This is the unique URL of your CTTM Ground Truth Ledger Google Sheet
 # You must update this variable after you create your sheet.
@@ -13,59 +15,67 @@ SHEET_NAME = "Form Responses 1"
 
 # --- CTTM-J READING FUNCTION ---
 
-@st.cache_data(ttl=datetime.timedelta(minutes=5))
-def load_junos_intelligence():
+JUNOS_CONFIGURED = "YOUR_SHEET_ID_HERE" not in SHEET_URL
+
+@st.cache_resource(ttl=datetime.timedelta(minutes=5))
+def load_junos_frame() -> pd.DataFrame:
     """
-    Connects to the secure CTTM Ground Truth Ledger via Google Sheets 
-    and filters for the 'Actionable Intelligence' layer (Junos Push).
-    
-    This function requires the GCP Service Account credentials to be set 
+    Connects to the secure CTTM Ground Truth Ledger via Google Sheets and returns
+    the 'Actionable Intelligence' layer (Junos Push) as structured corpus records
+    (see cttm_corpus.junos_records), ready for ranking alongside the ledger.
+
+    The frame is shared across sessions (cache_resource, no per-call unpickling)
+    and must be treated as read-only; attrs["junos_version"] identifies it cheaply.
+
+    This function requires the GCP Service Account credentials to be set
     in Streamlit Secrets under the 'gsheets' connection name.
     """
+    if not JUNOS_CONFIGURED:
+        return junos_records(None)
+    # 1. Establish Secure Connection
+    # Streamlit automatically uses the secrets configured for 'gsheets'
+    conn = st.connection("gsheets", type=GSheetsConnection)
+
+    # 2. Read the Raw Data from the Form Responses Sheet
+    # The 'usecols' ensures we only fetch the columns we need for CTTM-J:
+    # Timestamp, Report, Confidence, Junos Tag (MUST MATCH YOUR GOOGLE FORM ORDER!)
+    data = conn.read(
+        spreadsheet=SHEET_URL,
+        worksheet=SHEET_NAME,
+        usecols=[0, 1, 2, 3]
+    )
+
+    # 3. Filter for Junos Insight Criteria (Paññā Logic) with vectorized ops:
+    # Junos_Tag = True and confidence below 100%.
+    records = junos_records(data)
+    records.attrs["junos_version"] = cheap_frame_version(data)
+    return records
+
+
+def load_junos_records():
+    """CTTM-J records for the retrieval corpus, or None when the Junos sheet is unavailable."""
+    try:
+        return load_junos_frame()
+    except Exception as e:
+        print(f"RAG Warning: Junos intelligence unavailable: {e}")
+        return None
+
+
+def load_junos_intelligence():
+    """
+    Returns the Junos layer as one RAG-ready string (kept for callers that
+    inject it directly into the Gemini prompt).
+    """
     try:
-        # 1. Establish Secure Connection
-        # Streamlit automatically uses the secrets configured for 'gsheets'
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        
-        # 2. Read the Raw Data from the Form Responses Sheet
-        # The 'usecols' ensures we only fetch the columns we need for CTTM-J
-        data = conn.read(
-            spreadsheet=SHEET_URL,
-            worksheet=SHEET_NAME,
-            usecols=[0, 1, 2, 3] # Assuming Timestamp, Report, Confidence, Junos Tag
-        )
-        
-        # 3. Clean and Rename Columns (MUST MATCH YOUR GOOGLE FORM ORDER!)
-        # The column names are what the Google Form creates. You must confirm these.
-        data.columns = [
-            'Timestamp', 
-            'Intelligence_Report', 
-            'Confidence_Level', 
-            'Junos_Tag' # This should be True/False based on the form checkbox
-        ]
-        
-        # 4. Filter for Junos Insight Criteria (Paññā Logic)
-        # Filters for high-priority unconfirmed news (Junos_Tag = True)
-        # And data where confidence is not 100% (based on your dropdown structure)
-        junos_intelligence = data[
-            (data['Junos_Tag'] == True) & 
-            (~data['Confidence_Level'].str.contains("100%", na=False))
-        ].copy() # Use .copy() to avoid SettingWithCopyWarning
-        
-        # 5. Format Output for RAG Injection
-        # We convert the DataFrame rows into a list of strings for the Gemini RAG prompt
-        junos_list = []
-        for index, row in junos_intelligence.iterrows():
-            confidence_score = row['Confidence_Level'].split(' ')[0] # Extract the percentage
-            report = f"[{row['Timestamp']}] [INTELLIGENCE: {confidence_score} CONFIDENCE] {row['Intelligence_Report']}"
-            junos_list.append(report)
-            
-        return "\n".join(junos_list)
+        records = load_junos_frame()
+        # 4. Format Output for RAG Injection
+        confidence = (records['Confidence'] * 100).round().astype(int).astype(str) + "%"
+        reports = "[" + records['Timestamp'] + "] [INTELLIGENCE: " + confidence + " CONFIDENCE] " + records['Fact_Text']
+        return "\n".join(reports)
 
     except Exception as e:
         # Returns an error message that the main app can handle
         return f"🚨 CTTM-J Data Error: Could not load Junos Insight. Check Google Sheets connection and secrets. Error: {e}"
 
-# Example of how to use this in your dhammi_chat function:
-# junos_context = load_junos_intelligence() 
-# Inject junos_context into your Gemini prompt for the CTTM-J capability.
+# The pipeline ranks Junos reports together with the ledger through
+# cttm_corpus.CorpusBuilder(junos_loader=load_junos_records).
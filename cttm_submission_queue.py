@@ -0,0 +1,161 @@
+# cttm_submission_queue.py - Durable write-behind queue for CTTM fact submissions
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+
+from dhammi_metrics import METRICS
+
+# ----------------------------- 1. CONFIGURATION -----------------------------
+QUEUE_PATH = os.environ.get("CTTM_QUEUE_PATH", os.path.join(".cttm_cache", "cttm_submissions.sqlite"))
+FLUSH_BATCH_SIZE = 50
+FLUSH_DELAY_SECONDS = 2.0        # wait briefly so rapid submissions share one append
+RETRY_BASE_SECONDS = 5.0
+RETRY_MAX_SECONDS = 600.0
+CLAIM_LEASE_SECONDS = 120.0      # rows being appended are hidden from other flushers this long
+
+# Receives a DataFrame of ledger rows and appends them to the worksheet in one call.
+BatchAppender = Callable[[pd.DataFrame], None]
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** attempts)))
+
+
+# ----------------------------- 2. SUBMISSION QUEUE -----------------------------
+class SubmissionQueue:
+    """Acknowledges submissions once they are on local disk and flushes them to Sheets in batches."""
+
+    def __init__(self, append_rows: Optional[BatchAppender], path: str = QUEUE_PATH,
+                 on_flushed: Optional[Callable[[List[Dict[str, Any]]], None]] = None):
+        self.append_rows = append_rows
+        self.path = path
+        self.on_flushed = on_flushed
+        self.last_error: Optional[str] = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS pending ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL, created REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def enqueue(self, row: Dict[str, Any]) -> int:
+        """Durably records one ledger row. Returns its queue id."""
+        now = time.time()
+        with self._connect() as db:
+            cursor = db.execute(
+                "INSERT INTO pending (payload, next_attempt, created) VALUES (?, ?, ?)",
+                (json.dumps(row, ensure_ascii=False), now + FLUSH_DELAY_SECONDS, now),
+            )
+            queue_id = cursor.lastrowid
+        self._wake.set()
+        return queue_id
+
+    def pending_rows(self) -> List[Dict[str, Any]]:
+        """Rows accepted locally but not yet confirmed by Sheets."""
+        with self._connect() as db:
+            rows = db.execute("SELECT payload FROM pending ORDER BY id").fetchall()
+        return [json.loads(payload) for (payload,) in rows]
+
+    def __len__(self) -> int:
+        with self._connect() as db:
+            (count,) = db.execute("SELECT COUNT(*) FROM pending").fetchone()
+        return int(count)
+
+    def flush(self) -> int:
+        """Sends one batch of due rows. Returns the number of rows appended."""
+        if self.append_rows is None:
+            return 0
+        now = time.time()
+        with self._connect() as db:
+            # Claim the batch in one write transaction, so processes sharing the
+            # queue file never append the same rows.
+            db.execute("BEGIN IMMEDIATE")
+            (next_attempt,) = db.execute("SELECT MIN(next_attempt) FROM pending").fetchone()
+            if next_attempt is None or next_attempt > now:
+                return 0
+            # Once the oldest row is due, take everything that would be due within
+            # the batching window too, so bursts of submissions share one append.
+            batch = db.execute(
+                "SELECT id, payload, attempts FROM pending WHERE next_attempt <= ? ORDER BY id LIMIT ?",
+                (now + FLUSH_DELAY_SECONDS, FLUSH_BATCH_SIZE),
+            ).fetchall()
+            ids = [row_id for row_id, _, _ in batch]
+            placeholders = ",".join("?" * len(ids))
+            if ids:
+                db.execute(f"UPDATE pending SET next_attempt = ? WHERE id IN ({placeholders})",
+                           (now + CLAIM_LEASE_SECONDS, *ids))
+        if not batch:
+            return 0
+
+        rows = [json.loads(payload) for _, payload, _ in batch]
+        try:
+            with METRICS.span("sheets_append", rows=len(rows)):
+                self.append_rows(pd.DataFrame(rows))
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"CTTM Queue Warning: batch of {len(rows)} failed, will retry: {e}")
+            attempts = max(a for _, _, a in batch) + 1
+            with self._connect() as db:
+                db.execute(
+                    f"UPDATE pending SET attempts = ?, next_attempt = ? WHERE id IN ({placeholders})",
+                    (attempts, time.time() + retry_delay(attempts), *ids),
+                )
+            return 0
+
+        self.last_error = None
+        with self._connect() as db:
+            db.execute(f"DELETE FROM pending WHERE id IN ({placeholders})", ids)
+        if self.on_flushed is not None:
+            self.on_flushed(rows)
+        return len(rows)
+
+    def _next_wait(self) -> float:
+        if self.append_rows is None:
+            # Sheets is not configured: rows stay queued locally, nothing to poll for.
+            return RETRY_MAX_SECONDS
+        with self._connect() as db:
+            (next_attempt,) = db.execute("SELECT MIN(next_attempt) FROM pending").fetchone()
+        if next_attempt is None:
+            return RETRY_MAX_SECONDS
+        return max(0.0, next_attempt - time.time())
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                while self.flush():
+                    pass
+                wait = self._next_wait()
+            except Exception as e:
+                print(f"CTTM Queue Warning: {e}")
+                wait = RETRY_BASE_SECONDS
+            self._wake.wait(timeout=wait)
+            self._wake.clear()
+
+    def start(self):
+        """Starts the background flusher (idempotent)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cttm-submissions", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
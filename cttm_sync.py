@@ -0,0 +1,277 @@
+# cttm_sync.py - Incremental Google Sheets -> local SQLite snapshot sync for the CTTM Ledger
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from dhammi_metrics import METRICS
+
+# ----------------------------- 1. CONFIGURATION -----------------------------
+SNAPSHOT_PATH = os.environ.get("CTTM_SNAPSHOT_PATH", os.path.join(".cttm_cache", "cttm_ledger.sqlite"))
+LEDGER_COLUMNS = ["Timestamp", "Category", "Confidence", "Fact_Text", "Source"]
+# Submission id appended as a sixth worksheet column. Rows are identified by it
+# (or by their worksheet row when it is blank), never by cell contents, which
+# Sheets may re-format on the way back.
+ROW_ID_COLUMN = "Row_ID"
+SHEET_COLUMNS = LEDGER_COLUMNS + [ROW_ID_COLUMN]
+# Same freshness window the old st.cache_data(ttl=600) gave us.
+REFRESH_INTERVAL_SECONDS = 600
+
+# A fetcher receives the number of data rows already stored locally and returns
+# the worksheet rows after that point (or None when Sheets is not configured).
+RowFetcher = Callable[[int], Optional[pd.DataFrame]]
+
+# Low-cardinality columns are stored as categoricals; free text uses Arrow-backed
+# strings when pyarrow is installed.
+CATEGORICAL_COLUMNS = ("Category", "Source", "Source_Type")
+try:
+    import pyarrow  # noqa: F401
+    TEXT_DTYPE = pd.StringDtype("pyarrow")
+except ImportError:
+    print("CTTM Sync Warning: pyarrow is not installed; ledger text columns use Python-object strings.")
+    TEXT_DTYPE = pd.StringDtype()
+
+
+def new_row_id() -> str:
+    return uuid.uuid4().hex
+
+
+def clean_ledger_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """Normalises raw worksheet rows to the SHEET_COLUMNS layout (Row_ID may be None)."""
+    df = df.copy()
+    for col in SHEET_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+    df = df[SHEET_COLUMNS]
+    # V-Scores are shares (0-1); retrieval's top-k pruning relies on that range.
+    df['Confidence'] = pd.to_numeric(df['Confidence'], errors='coerce').fillna(0.0).clip(0.0, 1.0)
+    for col in ("Timestamp", "Category", "Fact_Text", "Source", ROW_ID_COLUMN):
+        df[col] = df[col].map(lambda v: None if pd.isna(v) or v == "" else str(v))
+    return df
+
+
+def row_id_digest(row_ids: Iterable[str]) -> int:
+    """Order-independent 64-bit digest of a set of row ids, so it can be extended per row."""
+    hashes = pd.util.hash_pandas_object(pd.Series(list(row_ids), dtype=object), index=False)
+    return int(hashes.to_numpy().sum(dtype=np.uint64))  # wraps modulo 2**64
+
+
+def row_id_version(digest: int, rows: int) -> str:
+    return hashlib.sha1(f"{rows}:{digest}".encode("ascii")).hexdigest()[:16]
+
+
+def compact_ledger_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Categorical Category/Source and compact string columns for the shared snapshot."""
+    conversions = {col: "category" for col in CATEGORICAL_COLUMNS if col in df.columns}
+    conversions.update({col: TEXT_DTYPE for col in ("Timestamp", "Fact_Text", ROW_ID_COLUMN) if col in df.columns})
+    return df.astype(conversions)
+
+
+@dataclass(frozen=True)
+class LedgerSnapshot:
+    """One published, immutable version of the ledger.
+
+    The frame is shared by every session and thread in the process: readers get
+    the same object (no copy, no unpickling) and must treat it as read-only.
+    Refreshes build a new snapshot and swap the reference in one assignment.
+    The version depends only on the set of row ids (see row_id_digest).
+    """
+    frame: pd.DataFrame
+    version: str
+    generation: int
+    rows: int
+
+
+# ----------------------------- 2. LEDGER SYNC -----------------------------
+class LedgerSync:
+    """Serves the ledger from a local snapshot and pulls new Sheets rows in the background."""
+
+    def __init__(self, fetch_rows: Optional[RowFetcher], path: str = SNAPSHOT_PATH,
+                 refresh_interval: float = REFRESH_INTERVAL_SECONDS):
+        self.fetch_rows = fetch_rows
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._current: Optional[LedgerSnapshot] = None
+        self._generation = 0
+        # Rows submitted from this process that Sheets has not echoed back yet,
+        # and those of them not yet merged into the published frame.
+        self._local_rows: List[Dict[str, Any]] = []
+        self._unmerged: List[Dict[str, Any]] = []
+        self._last_refresh: Optional[float] = None
+        self._loaded_rows: Optional[int] = None
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _init_db(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS facts ("
+                "row_num INTEGER PRIMARY KEY, Timestamp TEXT, Category TEXT, "
+                "Confidence REAL, Fact_Text TEXT, Source TEXT, Row_ID TEXT)"
+            )
+            columns = {name for _, name, *_ in db.execute("PRAGMA table_info(facts)")}
+            if ROW_ID_COLUMN not in columns:
+                db.execute("ALTER TABLE facts ADD COLUMN Row_ID TEXT")
+
+    # --- Reads (never touch the network) ---
+    def last_row(self) -> int:
+        """Number of worksheet data rows already mirrored locally."""
+        with self._connect() as db:
+            (count,) = db.execute("SELECT COALESCE(MAX(row_num) + 1, 0) FROM facts").fetchone()
+        return int(count)
+
+    @staticmethod
+    def _finish_frame(df: pd.DataFrame, digest: Optional[int] = None) -> pd.DataFrame:
+        df['Confidence'] = pd.to_numeric(df['Confidence'], errors='coerce').fillna(0.0)
+        df = compact_ledger_dtypes(df.sort_values(by='Confidence', ascending=False, kind="stable"))
+        if digest is None:
+            digest = row_id_digest(df[ROW_ID_COLUMN].astype(object))
+        df.attrs["row_id_digest"] = digest
+        df.attrs["ledger_version"] = row_id_version(digest, len(df))
+        return df
+
+    def _publish(self, frame: pd.DataFrame) -> LedgerSnapshot:
+        """Swaps in a new snapshot (caller holds self._lock)."""
+        self._generation += 1
+        snapshot = LedgerSnapshot(frame=frame, version=frame.attrs["ledger_version"],
+                                  generation=self._generation, rows=len(frame))
+        self._current = snapshot
+        return snapshot
+
+    @property
+    def _frame(self) -> Optional[pd.DataFrame]:
+        current = self._current
+        return current.frame if current is not None else None
+
+    def _load_frame(self) -> pd.DataFrame:
+        with self._connect() as db:
+            (self._loaded_rows,) = db.execute("SELECT COALESCE(MAX(row_num) + 1, 0) FROM facts").fetchone()
+            df = pd.read_sql_query(
+                "SELECT Timestamp, Category, Confidence, Fact_Text, Source, "
+                "COALESCE(NULLIF(Row_ID, ''), 'row:' || row_num) AS Row_ID FROM facts "
+                "WHERE Fact_Text IS NOT NULL AND Fact_Text != '' ORDER BY row_num",
+                db,
+            )
+        self._unmerged = []
+        if self._local_rows:
+            synced = set(df[ROW_ID_COLUMN])
+            self._local_rows = [r for r in self._local_rows if r[ROW_ID_COLUMN] not in synced]
+            if self._local_rows:
+                df = pd.concat([df, pd.DataFrame(self._local_rows, columns=SHEET_COLUMNS)], ignore_index=True)
+        return self._finish_frame(df)
+
+    def _merge_local(self) -> LedgerSnapshot:
+        """Publishes the frame with rows added since the last publish (caller holds self._lock)."""
+        base = self._current.frame
+        rows = pd.DataFrame(self._unmerged, columns=SHEET_COLUMNS)
+        digest = (base.attrs["row_id_digest"] + row_id_digest(rows[ROW_ID_COLUMN])) % 2 ** 64
+        self._unmerged = []
+        return self._publish(self._finish_frame(pd.concat([base, rows], ignore_index=True), digest))
+
+    def current(self) -> LedgerSnapshot:
+        """Returns the published snapshot immediately (O(1)) and schedules a refresh when stale."""
+        snapshot = self._current
+        METRICS.record_cache("ledger", hit=snapshot is not None and not self._unmerged)
+        if snapshot is None or self._unmerged:
+            with self._lock:
+                snapshot = self._current
+                if snapshot is None:
+                    snapshot = self._publish(self._load_frame())
+                elif self._unmerged:
+                    snapshot = self._merge_local()
+        if self._last_refresh is None or time.monotonic() - self._last_refresh >= self.refresh_interval:
+            self.refresh_async()
+        return snapshot
+
+    def snapshot(self) -> pd.DataFrame:
+        """The current shared, read-only ledger frame."""
+        return self.current().frame
+
+    # --- Writes ---
+    def add_local_rows(self, rows: List[Dict[str, Any]]) -> str:
+        """Adds rows submitted from this process before Sheets has them. Returns the new version.
+
+        Only the version is computed here (from the row ids); the rows are merged
+        into the shared frame on the next read, so a submission never copies the
+        ledger. Rows without a Row_ID get a fresh one.
+        """
+        new_rows = clean_ledger_rows(pd.DataFrame(rows))
+        new_rows[ROW_ID_COLUMN] = [row_id or new_row_id() for row_id in new_rows[ROW_ID_COLUMN]]
+        records = new_rows.to_dict("records")
+        with self._lock:
+            if self._current is None:
+                self._publish(self._load_frame())
+            frame = self._current.frame
+            merged = {r[ROW_ID_COLUMN] for r in self._local_rows}
+            records = [r for r in records if r[ROW_ID_COLUMN] not in merged]
+            self._local_rows.extend(records)
+            self._unmerged.extend(records)
+            pending = pd.Series([r[ROW_ID_COLUMN] for r in self._unmerged], dtype=object)
+            digest = (frame.attrs["row_id_digest"] + row_id_digest(pending)) % 2 ** 64
+            return row_id_version(digest, len(frame) + len(self._unmerged))
+
+    def store_rows(self, rows: pd.DataFrame, start_row: int) -> int:
+        """Persists worksheet rows starting at start_row. Returns the number stored."""
+        if rows is None or rows.empty:
+            return 0
+        rows = clean_ledger_rows(rows)
+        records = [
+            (start_row + i, *values)
+            for i, values in enumerate(rows.itertuples(index=False, name=None))
+        ]
+        with self._connect() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO facts "
+                "(row_num, Timestamp, Category, Confidence, Fact_Text, Source, Row_ID) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                records,
+            )
+        return len(records)
+
+    def refresh(self) -> int:
+        """Fetches rows newer than the local snapshot. Returns the number of new rows."""
+        self._last_refresh = time.monotonic()
+        if self.fetch_rows is None:
+            # Read-only follower (e.g. the API server): another process keeps the
+            # snapshot current, so just pick up rows it has written since our load.
+            if self._frame is not None and self.last_row() != self._loaded_rows:
+                with self._lock:
+                    self._publish(self._load_frame())
+            return 0
+        start_row = self.last_row()
+        try:
+            with METRICS.span("sheets_read", start_row=start_row):
+                new_rows = self.fetch_rows(start_row)
+        except Exception as e:
+            print(f"CTTM Sync Warning: {e}")
+            return 0
+        added = self.store_rows(new_rows, start_row)
+        if added or self._frame is None:
+            with self._lock:
+                self._publish(self._load_frame())
+        return added
+
+    def refresh_async(self):
+        """Starts a background refresh unless one is already running."""
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            # Claim the slot now so concurrent reruns do not spawn duplicate threads.
+            self._last_refresh = time.monotonic()
+            self._refresh_thread = threading.Thread(target=self.refresh, name="cttm-sync", daemon=True)
+            self._refresh_thread.start()
@@ -4,7 +4,13 @@ from bs4 import BeautifulSoup
 import datetime
 import json
 import os
-from cttm_knowledge import load_cttm_facts, save_cttm_facts, CTTM_FILE_PATH
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from cttm_journal import atomic_write
+from cttm_knowledge import put_cttm_fact
 
 # ----------------------------- 1. DEFINED TRUSTED SOURCES -----------------------------
 # These URLs are placeholders and must be verified and potentially adjusted
@@ -16,51 +22,152 @@ TRUSTED_SOURCES = {
     "BBC_Burmese": "https://www.bbc.com/burmese" # Note: BBC Burmese is often in Burmese script
 }
 
+# CSS selectors for headline links on each source, tried in order.
+# Like the URLs above, these must be checked against the live page markup.
+HEADLINE_SELECTORS: Dict[str, List[str]] = {
+    "Irrawaddy": ["h3.jeg_post_title a", "h2.jeg_post_title a"],
+    "MyanmarNow": ["h2.entry-title a", "h3.entry-title a"],
+    "DVB": ["h2.post-title a", "h3 a"],
+    "BBC_Burmese": ["h3 a", "h2 a"],
+}
+# Used when a source has no entry above or its selectors match nothing.
+DEFAULT_HEADLINE_SELECTORS = ["h2 a", "h3 a", "h2", "h3"]
+HEADLINES_PER_SOURCE = 3
+
 # ----------------------------- 2. CORE SCRAPING LOGIC -----------------------------
+REQUEST_TIMEOUT = 10
+MAX_WORKERS = 16               # Total sources fetched in parallel
+MAX_CONNECTIONS_PER_HOST = 2   # Politeness limit per news site
+HTTP_CACHE_PATH = "cttm_http_cache.json"
+USER_AGENT = "DHAMMI-CTTM-Updater/6 (+https://github.com/UIngarsoe/gemini-rag-cttm-v6)"
+
+_host_limits: Dict[str, threading.BoundedSemaphore] = {}
+_host_limits_lock = threading.Lock()
+
+
+def _host_limit(url: str) -> threading.BoundedSemaphore:
+    """Returns the shared semaphore that caps concurrent requests to one host."""
+    host = urlparse(url).netloc
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(MAX_CONNECTIONS_PER_HOST)
+        return _host_limits[host]
+
+
+def build_session() -> requests.Session:
+    """Keep-alive session whose connection pool is sized for the worker pool."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+def load_http_cache() -> Dict[str, Any]:
+    """Loads ETag/Last-Modified validators and last parsed headlines per URL."""
+    if not os.path.exists(HTTP_CACHE_PATH):
+        return {}
+    try:
+        with open(HTTP_CACHE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        print("Warning: HTTP cache is unreadable. Refetching all sources.")
+        return {}
+
+
+def save_http_cache(cache: Dict[str, Any]):
+    """Writes the HTTP cache atomically so an interrupted run cannot corrupt it."""
+    data = json.dumps(cache, ensure_ascii=False).encode('utf-8')
+    atomic_write(HTTP_CACHE_PATH, lambda f: f.write(data))
+
+
+def extract_headlines(name: str, html: bytes) -> List[str]:
+    """Parses the top headlines from a source page using its selectors."""
+    soup = BeautifulSoup(html, 'html.parser')
+    for selector in HEADLINE_SELECTORS.get(name, []) + DEFAULT_HEADLINE_SELECTORS:
+        headlines = []
+        for tag in soup.select(selector):
+            text = " ".join(tag.get_text(" ", strip=True).split())
+            if text and text not in headlines:
+                headlines.append(text)
+            if len(headlines) >= HEADLINES_PER_SOURCE:
+                break
+        if headlines:
+            return headlines
+    return []
+
+
+def fetch_source(session: requests.Session, name: str, url: str,
+                 cached: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Fetches one source with conditional-GET revalidation. Returns its new cache entry."""
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    with _host_limit(url):
+        response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+
+    if response.status_code == 304 and cached:
+        # Page unchanged since the last run: reuse the headlines we already parsed.
+        return dict(cached, accessed=datetime.datetime.now().strftime('%Y-%m-%d %H:%M'))
+
+    response.raise_for_status()
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "headlines": extract_headlines(name, response.content),
+        "accessed": datetime.datetime.now().strftime('%Y-%m-%d %H:%M'),
+    }
+
+
 def fetch_and_summarize_news() -> str:
     """Fetches headlines from trusted sources and returns a summarized string."""
-    all_headlines = []
-    
-    for name, url in TRUSTED_SOURCES.items():
-        try:
-            # We are using a simple request, which is fine for basic content
-            response = requests.get(url, timeout=10)
-            response.raise_for_status() # Raise an exception for bad status codes
-            
-            # Simple summarization: we only need the URL and the source name for now
-            all_headlines.append(f"Source: {name} (Accessed: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')})")
-            
-            # NOTE: For a real solution, you would use BeautifulSoup (bs4) 
-            # to parse the HTML and extract the actual headline text from specific tags.
-            # Example of what you would do (requires 'pip install beautifulsoup4'):
-            # soup = BeautifulSoup(response.content, 'html.parser')
-            # headlines = soup.find_all('h2', class_='headline-class') # Placeholder class
-            # for h in headlines[:3]: # Get top 3 headlines
-            #    all_headlines.append(f"- {h.text.strip()}")
-            
-            # For this exercise, we'll keep the output simple as a placeholder
-            all_headlines.append(f"- [Latest News Summary from {name}]")
+    http_cache = load_http_cache()
+    session = build_session()
 
+    def fetch(item):
+        name, url = item
+        try:
+            return name, fetch_source(session, name, url, http_cache.get(url)), None
         except requests.exceptions.RequestException as e:
-            all_headlines.append(f"Source: {name} - Connection Error: {e}")
+            return name, None, f"Connection Error: {e}"
+        except Exception as e:
+            # A page that fails to parse costs only its own headlines, not the run.
+            return name, None, f"Parse Error: {e}"
 
+    # All sources are requested at once, so a run takes roughly one round trip.
+    with session, ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(TRUSTED_SOURCES) or 1)) as pool:
+        results = list(pool.map(fetch, TRUSTED_SOURCES.items()))
+
+    all_headlines = []
+    for name, entry, error in results:
+        if error is not None:
+            all_headlines.append(f"Source: {name} - {error}")
+            continue
+        http_cache[TRUSTED_SOURCES[name]] = entry
+        all_headlines.append(f"Source: {name} (Accessed: {entry['accessed']})")
+        if entry["headlines"]:
+            all_headlines.extend(f"- {headline}" for headline in entry["headlines"])
+        else:
+            all_headlines.append(f"- [No headlines parsed from {name}]")
+
+    save_http_cache(http_cache)
     return "\n".join(all_headlines)
 
 # ----------------------------- 3. UPDATE CTTM FACT FILE -----------------------------
 def update_cttm_facts():
     """Fetches news and updates the CTTM fact file with the latest headlines."""
     
-    # Load current facts (including the essential political facts)
-    current_facts = load_cttm_facts()
-    
     # Fetch the new data
     latest_news_summary = fetch_and_summarize_news()
     
-    # Update the dictionary with the new real-time fact (Paññā update)
-    current_facts["FACT_DAILY_HEADLINES"] = latest_news_summary
-    
-    # Save the updated facts back to the JSON file
-    save_cttm_facts(current_facts)
+    # Append the new real-time fact (Paññā update) to the fact journal;
+    # the essential political facts are left untouched.
+    put_cttm_fact("FACT_DAILY_HEADLINES", latest_news_summary)
     
     print("✅ CTTM Fact Database updated successfully with latest news.")
     
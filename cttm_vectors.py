@@ -0,0 +1,181 @@
+# cttm_vectors.py - Offline dense-vector semantic retrieval over the CTTM Ledger
+import glob
+import hashlib
+import os
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cttm_journal import atomic_write
+from cttm_retrieval import CONFIDENCE_WEIGHT, ledger_version, tokenize
+
+# ----------------------------- 1. EMBEDDING CONFIGURATION -----------------------------
+# Vectors are stored next to the app so every Streamlit worker on the box maps the
+# same file and shares its pages through the OS page cache.
+VECTOR_CACHE_DIR = os.environ.get("CTTM_VECTOR_DIR", ".cttm_cache")
+EMBEDDING_DIM = 512
+CHAR_NGRAM_SIZES = (3, 4)
+# Rows scored per matrix-vector product; keeps temporary buffers small on huge ledgers.
+SEARCH_BATCH_ROWS = 65536
+# Matrices kept on disk per cache directory: the live one plus one another worker
+# may still be switching away from. Older ones, and stale temp files, are deleted.
+VECTOR_FILES_KEPT = 2
+STALE_TEMP_SECONDS = 3600
+
+
+def _bucket(feature: str) -> Tuple[int, float]:
+    """Maps a feature to a (dimension, sign) pair with a stable hash."""
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % EMBEDDING_DIM, (1.0 if (h >> 16) & 1 else -1.0)
+
+
+def embed_text(text: str) -> np.ndarray:
+    """Hashed word + character n-gram embedding, L2-normalised (float32)."""
+    vec = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for word in tokenize(text):
+        dim, sign = _bucket("w:" + word)
+        vec[dim] += sign
+        padded = f"<{word}>"
+        for n in CHAR_NGRAM_SIZES:
+            for i in range(len(padded) - n + 1):
+                dim, sign = _bucket(padded[i:i + n])
+                # Sub-word features carry less weight than whole words.
+                vec[dim] += 0.5 * sign
+    norm = np.linalg.norm(vec)
+    if norm > 0:
+        vec /= norm
+    return vec
+
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """Embeds a list of texts into an (n, EMBEDDING_DIM) float32 matrix."""
+    matrix = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    for i, text in enumerate(texts):
+        matrix[i] = embed_text(text)
+    return matrix
+
+
+# ----------------------------- 2. ON-DISK MATRIX -----------------------------
+def vector_file_path(version: str) -> str:
+    config = f"{EMBEDDING_DIM}-{'-'.join(map(str, CHAR_NGRAM_SIZES))}"
+    tag = hashlib.sha1(f"{version}:{config}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(VECTOR_CACHE_DIR, f"cttm_vectors_{tag}.npy")
+
+
+def embed_incrementally(texts: List[str], previous: Optional["CTTMVectorIndex"] = None) -> np.ndarray:
+    """Embeds texts, copying rows for texts the previous index already embedded.
+
+    Embeddings depend only on the text, so a new ledger version (usually a few
+    appended facts, possibly re-sorted) only pays for the texts that are new.
+    """
+    if previous is None or len(previous) == 0 or previous.matrix.shape[1] != EMBEDDING_DIM:
+        return embed_texts(texts)
+    known = {str(r.get("Fact_Text", "")): i for i, r in enumerate(previous.records)}
+    matrix = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    reused = [(i, known[t]) for i, t in enumerate(texts) if t in known]
+    if reused:
+        rows, source = map(np.array, zip(*reused))
+        matrix[rows] = previous.matrix[source]
+    for i, text in enumerate(texts):
+        if text not in known:
+            matrix[i] = embed_text(text)
+    return matrix
+
+
+def build_vector_file(df: pd.DataFrame, version: str, previous: Optional["CTTMVectorIndex"] = None) -> str:
+    """Writes the embedding matrix for a ledger version, atomically. Returns the path."""
+    path = vector_file_path(version)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(VECTOR_CACHE_DIR, exist_ok=True)
+    matrix = embed_incrementally(df["Fact_Text"].astype(str).tolist(), previous)
+    # Temp file + rename so concurrent workers never map a half-written file.
+    atomic_write(path, lambda f: np.save(f, matrix), suffix=".npy.tmp")
+    return path
+
+
+def prune_vector_files(keep: str, kept: int = VECTOR_FILES_KEPT):
+    """Deletes superseded matrices (oldest first) and temp files left by crashed builds.
+
+    Workers that still map a deleted matrix keep reading it; the OS frees it on unmap.
+    """
+    now = time.time()
+    try:
+        matrices = sorted(glob.glob(os.path.join(VECTOR_CACHE_DIR, "cttm_vectors_*.npy")),
+                          key=os.path.getmtime, reverse=True)
+        stale = [m for m in matrices if m != keep][max(0, kept - 1):]
+        stale += [t for t in glob.glob(os.path.join(VECTOR_CACHE_DIR, "*.npy.tmp"))
+                  if now - os.path.getmtime(t) > STALE_TEMP_SECONDS]
+        for path in stale:
+            os.remove(path)
+    except OSError as e:
+        print(f"RAG Warning: could not prune vector files: {e}")
+
+
+# ----------------------------- 3. VECTOR INDEX -----------------------------
+class CTTMVectorIndex:
+    """Memory-mapped embedding matrix with batched matrix-vector top-k search."""
+
+    def __init__(self, matrix: np.ndarray, records: List[Dict[str, Any]], version: str = "empty",
+                 path: Optional[str] = None):
+        self.matrix = matrix
+        self.records = records
+        self.version = version
+        self.path = path
+        self.confidences = np.array(
+            [float(r.get("Confidence", 0.0) or 0.0) for r in records], dtype=np.float32
+        )
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, version: Optional[str] = None,
+                       previous: Optional["CTTMVectorIndex"] = None) -> "CTTMVectorIndex":
+        """Builds (or reuses) the on-disk matrix for this ledger and maps it read-only.
+
+        Rows of `previous` are reused for unchanged fact texts.
+        """
+        version = version or ledger_version(df)
+        if df is None or df.empty:
+            return cls(np.zeros((0, EMBEDDING_DIM), dtype=np.float32), [], version)
+        path = build_vector_file(df, version, previous)
+        try:
+            matrix = np.load(path, mmap_mode="r")
+        except FileNotFoundError:
+            # Pruned by another worker between the existence check and the map: build it again.
+            matrix = np.load(build_vector_file(df, version, previous), mmap_mode="r")
+        return cls(matrix, df.to_dict("records"), version, path)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[Dict[str, Any], float]]:
+        """Returns the top-k (record, score) pairs by cosine similarity blended with V-Score."""
+        n_rows = self.matrix.shape[0]
+        if n_rows == 0 or k <= 0:
+            return []
+        q = embed_text(query)
+        if not q.any():
+            return []
+
+        best_ids = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, n_rows, SEARCH_BATCH_ROWS):
+            stop = min(start + SEARCH_BATCH_ROWS, n_rows)
+            sims = self.matrix[start:stop] @ q
+            scores = (1.0 - CONFIDENCE_WEIGHT) * sims + CONFIDENCE_WEIGHT * self.confidences[start:stop]
+            # Ignore facts with no lexical/sub-word overlap at all.
+            scores = np.where(sims > 0, scores, -np.inf)
+            take = min(k, stop - start)
+            part = np.argpartition(-scores, take - 1)[:take]
+            best_ids = np.concatenate([best_ids, part + start])
+            best_scores = np.concatenate([best_scores, scores[part]])
+
+        order = np.argsort(-best_scores)[:k]
+        return [
+            (self.records[int(best_ids[i])], float(best_scores[i]))
+            for i in order
+            if np.isfinite(best_scores[i])
+        ]
@@ -0,0 +1,180 @@
+# dhammi_answer_cache.py - Response cache in front of the Gemini call in dhammi_chat
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from dhammi_metrics import METRICS
+
+# ----------------------------- 1. CONFIGURATION -----------------------------
+ANSWER_CACHE_BACKEND = os.environ.get("DHAMMI_ANSWER_CACHE", "memory")  # "memory" or "sqlite"
+ANSWER_CACHE_PATH = os.environ.get("DHAMMI_ANSWER_CACHE_PATH", os.path.join(".cttm_cache", "answers.sqlite"))
+ANSWER_CACHE_TTL_SECONDS = 3600
+ANSWER_CACHE_MAX_ENTRIES = 1024
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Case-folds, collapses whitespace and drops trailing punctuation."""
+    text = " ".join(prompt.casefold().split())
+    return re.sub(r"[\s?!.。၊။]+$", "", text)
+
+
+def fingerprint(*parts: Any) -> str:
+    """Stable SHA-256 over JSON-serialisable parts."""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def make_cache_key(prompt: str, context_lines: List[str], history: List[Dict[str, str]],
+                   model_fingerprint: str, ledger_version: str) -> str:
+    """Builds the cache key for one model call.
+
+    Prior turns are part of the key so follow-up questions never reuse an answer
+    given in a different conversation; first-turn questions share entries.
+    """
+    turns = [(m.get("role"), m.get("content")) for m in history]
+    return fingerprint(normalize_prompt(prompt), fingerprint(context_lines), fingerprint(turns),
+                       model_fingerprint, ledger_version)
+
+
+# ----------------------------- 2. BACKENDS -----------------------------
+class MemoryBackend:
+    """In-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: float):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """On-disk LRU shared by every worker process on the box."""
+
+    def __init__(self, path: str = ANSWER_CACHE_PATH, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS answers_lru ON answers (last_access)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute("SELECT value, expires_at FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                db.execute("DELETE FROM answers WHERE key = ?", (key,))
+                return None
+            db.execute("UPDATE answers SET last_access = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: str, ttl: float):
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO answers (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now),
+            )
+            db.execute("DELETE FROM answers WHERE expires_at < ?", (now,))
+            db.execute(
+                "DELETE FROM answers WHERE key NOT IN "
+                "(SELECT key FROM answers ORDER BY last_access DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM answers")
+
+    def __len__(self) -> int:
+        with self._connect() as db:
+            (count,) = db.execute("SELECT COUNT(*) FROM answers").fetchone()
+        return int(count)
+
+
+# ----------------------------- 3. ANSWER CACHE -----------------------------
+class AnswerCache:
+    """LRU+TTL answer cache with hit/miss counters."""
+
+    def __init__(self, backend=None, ttl: float = ANSWER_CACHE_TTL_SECONDS):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        METRICS.record_cache("answer", hit=value is not None)
+        return value
+
+    def set(self, key: str, value: str):
+        if value:
+            self.backend.set(key, value, self.ttl)
+
+    def invalidate(self):
+        """Drops every cached answer (called when the ledger changes)."""
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.backend),
+        }
+
+
+def create_answer_cache(backend: str = ANSWER_CACHE_BACKEND) -> AnswerCache:
+    """Creates an AnswerCache with the configured backend."""
+    if backend == "sqlite":
+        return AnswerCache(SQLiteBackend())
+    return AnswerCache(MemoryBackend())
@@ -0,0 +1,382 @@
+# dhammi_api.py - Headless asyncio HTTP API for the DHAMMI chat pipeline (SSE streaming)
+"""
+Usage:
+    GEMINI_API_KEY=... python dhammi_api.py --port 8080 --concurrency 32
+
+Endpoints:
+    POST /v1/chat   {"prompt": "...", "history": [{"role": "user|assistant", "content": "..."}], "stream": true}
+                    An optional "summary" stands for the conversation before "history".
+                    stream=true answers with text/event-stream ("message" events carrying
+                    {"text": chunk}, then one "done" event); otherwise {"reply": "..."}.
+    GET  /healthz   liveness plus in-flight/waiting counts
+    GET  /metrics   Prometheus text from dhammi_metrics
+
+The server binds 127.0.0.1 unless DHAMMI_API_HOST says otherwise. Before exposing
+it, set DHAMMI_API_TOKEN: /v1/chat then requires "Authorization: Bearer <token>",
+and remote_chat sends the same variable.
+
+Each process keeps one warm DhammiPipeline (indexes, history summaries, answer
+cache) shared by all connections. To scale out, run several processes behind a
+load balancer; they read the same ledger snapshot (CTTM_SNAPSHOT_PATH), and can
+share answers with DHAMMI_ANSWER_CACHE=sqlite.
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+from cttm_sync import LedgerSync
+from dhammi_core import DhammiPipeline, client_from_env, create_corpus_builder
+from dhammi_metrics import METRICS
+
+# ----------------------------- 1. CONFIGURATION -----------------------------
+API_HOST = os.environ.get("DHAMMI_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("DHAMMI_API_PORT", "8080"))
+API_MAX_CONCURRENCY = int(os.environ.get("DHAMMI_API_CONCURRENCY", "32"))  # chats running at once
+API_MAX_WAITING = int(os.environ.get("DHAMMI_API_MAX_WAITING", "128"))     # queued before 503
+MAX_BODY_BYTES = 256 * 1024
+READ_TIMEOUT_SECONDS = 30.0
+REMOTE_TIMEOUT_SECONDS = 120.0
+STREAM_QUEUE_CHUNKS = 64  # chunks buffered per stream before the producer waits for the client
+API_TOKEN = os.environ.get("DHAMMI_API_TOKEN")  # bearer token required on /v1/chat when set
+
+# Metric route labels: anything else is counted as "other" to keep cardinality fixed.
+ROUTES = ("/v1/chat", "/healthz", "/metrics")
+
+_STREAM_END = object()
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 405: "Method Not Allowed",
+           408: "Request Timeout", 413: "Payload Too Large", 500: "Internal Server Error",
+           503: "Service Unavailable"}
+
+
+# ----------------------------- 2. HTTP PLUMBING -----------------------------
+async def read_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+    """Parses one HTTP/1.1 request (request line, headers, Content-Length body)."""
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    parts = request_line.split()
+    if len(parts) != 3:
+        raise HTTPError(400, "malformed request line")
+    method, target, _version = parts
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, f"body exceeds {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target.split("?", 1)[0], headers, body
+
+
+def response_head(status: int, content_type: str, length: Optional[int] = None,
+                  extra: Optional[Dict[str, str]] = None) -> bytes:
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {content_type}",
+             "Connection: close"]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    for name, value in (extra or {}).items():
+        lines.append(f"{name}: {value}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def parse_chat_request(body: bytes) -> Tuple[str, List[Dict[str, str]], bool, str]:
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPError(400, "body must be JSON")
+    prompt = payload.get("prompt")
+    if not isinstance(prompt, str) or not prompt.strip():
+        raise HTTPError(400, "prompt must be a non-empty string")
+    history = payload.get("history") or []
+    if not isinstance(history, list) or not all(
+        isinstance(m, dict) and m.get("role") in ("user", "assistant") and isinstance(m.get("content"), str)
+        for m in history
+    ):
+        raise HTTPError(400, "history must be a list of {role: user|assistant, content: str}")
+    history = [{"role": m["role"], "content": m["content"]} for m in history]
+    summary = payload.get("summary") or ""
+    if not isinstance(summary, str):
+        raise HTTPError(400, "summary must be a string")
+    return prompt, history, bool(payload.get("stream", False)), summary
+
+
+def is_authorized(headers: Dict[str, str], token: Optional[str]) -> bool:
+    if not token:
+        return True
+    scheme, _, presented = headers.get("authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(presented.strip().encode(), token.encode())
+
+
+# ----------------------------- 3. API SERVER -----------------------------
+class DhammiAPI:
+    """Serves one shared pipeline; blocking pipeline work runs on a bounded thread pool."""
+
+    def __init__(self, pipeline: DhammiPipeline, max_concurrency: int = API_MAX_CONCURRENCY,
+                 max_waiting: int = API_MAX_WAITING, token: Optional[str] = API_TOKEN):
+        self.pipeline = pipeline
+        self.token = token
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.in_flight = 0
+        self.waiting = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="dhammi-api")
+
+    async def warm_up(self):
+        """Loads the ledger and builds the retrieval index before the first request."""
+        loop = asyncio.get_running_loop()
+
+        def _warm():
+            df = self.pipeline.ledger_loader()
+            self.pipeline.retrieve(df, "warm up")
+            return 0 if df is None else len(df)
+
+        facts = await loop.run_in_executor(self._executor, _warm)
+        print(f"DHAMMI API: pipeline warm with {facts} ledger facts.")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        route, status = "unknown", 500
+        try:
+            try:
+                method, path, headers, body = await asyncio.wait_for(read_request(reader), READ_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                raise HTTPError(408, "request timed out")
+            except (asyncio.IncompleteReadError, ValueError):
+                raise HTTPError(400, "malformed request")
+            route = path if path in ROUTES else "other"
+            if path == "/v1/chat":
+                if method != "POST":
+                    raise HTTPError(405, "use POST")
+                if not is_authorized(headers, self.token):
+                    raise HTTPError(401, "missing or invalid bearer token")
+                status = await self.chat(writer, *parse_chat_request(body))
+            elif path == "/healthz":
+                status = await self.send_json(writer, 200, {
+                    "status": "ok", "in_flight": self.in_flight, "waiting": self.waiting,
+                    "max_concurrency": self.max_concurrency,
+                })
+            elif path == "/metrics":
+                text = METRICS.render_prometheus().encode("utf-8")
+                writer.write(response_head(200, "text/plain; version=0.0.4; charset=utf-8", len(text)) + text)
+                status = 200
+            else:
+                raise HTTPError(404, "not found")
+        except HTTPError as e:
+            extra = {"Retry-After": "1"} if e.status == 503 else (
+                {"WWW-Authenticate": "Bearer"} if e.status == 401 else None)
+            status = await self.send_json(writer, e.status, {"error": e.message}, extra)
+        except (ConnectionResetError, BrokenPipeError):
+            status = 499  # client went away
+        except Exception as e:
+            METRICS.error(e, "api")
+            print(f"DHAMMI API Error: {e}")
+            try:
+                status = await self.send_json(writer, 500, {"error": "internal error"})
+            except Exception:
+                pass
+        finally:
+            METRICS.inc("dhammi_api_requests_total", {"route": route, "status": status})
+            try:
+                await writer.drain()
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def send_json(self, writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any],
+                        extra: Optional[Dict[str, str]] = None) -> int:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(response_head(status, "application/json; charset=utf-8", len(body), extra) + body)
+        await writer.drain()
+        return status
+
+    async def chat(self, writer: asyncio.StreamWriter, prompt: str, history: List[Dict[str, str]],
+                   stream: bool, summary: str = "") -> int:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        if self.waiting >= self.max_waiting:
+            raise HTTPError(503, "server busy")
+        # The pipeline expects the new prompt as the last user turn, as in the Streamlit app.
+        messages = history + [{"role": "user", "content": prompt}]
+        loop = asyncio.get_running_loop()
+
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            if not stream:
+                reply = await loop.run_in_executor(self._executor, partial(self.pipeline.chat, summary=summary),
+                                                   prompt, messages, False)
+                return await self.send_json(writer, 200, {"reply": reply})
+
+            return await self.stream(writer, prompt, messages, summary)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    async def stream(self, writer: asyncio.StreamWriter, prompt: str, messages: List[Dict[str, str]],
+                     summary: str) -> int:
+        """Relays the reply as SSE. Once the headers are out, failures end the stream
+        with an "error" event and then "done", never with a second HTTP response."""
+        loop = asyncio.get_running_loop()
+        writer.write(response_head(200, "text/event-stream; charset=utf-8",
+                                   extra={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}))
+        await writer.drain()
+        # Bounded, so a slow client makes the producer wait instead of buffering the reply.
+        chunks: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_CHUNKS)
+        cancelled = threading.Event()
+        failures: List[BaseException] = []
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+        def produce():
+            try:
+                reply_stream = self.pipeline.chat(prompt, messages, stream=True, summary=summary)
+                for chunk in reply_stream:
+                    if cancelled.is_set():
+                        reply_stream.close()
+                        break
+                    put(chunk)
+            except Exception as e:
+                failures.append(e)
+            finally:
+                put(_STREAM_END)
+
+        producer = loop.run_in_executor(self._executor, produce)
+        try:
+            try:
+                while True:
+                    chunk = await chunks.get()
+                    if chunk is _STREAM_END:
+                        break
+                    writer.write(sse_event("message", {"text": chunk}))
+                    await writer.drain()
+                if failures:
+                    raise failures[0]
+                status = 200
+            except (ConnectionResetError, BrokenPipeError):
+                raise
+            except Exception as e:
+                METRICS.error(e, "api")
+                print(f"DHAMMI API Error: {e}")
+                writer.write(sse_event("error", {"error": "internal error"}))
+                status = 500
+            writer.write(sse_event("done", {}))
+            await writer.drain()
+            return status
+        finally:
+            cancelled.set()
+            # Unblock a producer still waiting on the full queue (e.g. the client left).
+            while not producer.done():
+                try:
+                    await asyncio.wait_for(chunks.get(), 0.1)
+                except asyncio.TimeoutError:
+                    pass
+            await producer
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def build_pipeline() -> DhammiPipeline:
+    """Pipeline for the headless server: Gemini from GEMINI_API_KEY, ledger from the local snapshot.
+
+    The snapshot is kept current by the Streamlit app (or any process with Sheets
+    access); the server follows it read-only.
+    """
+    client = client_from_env()
+    corpus = create_corpus_builder(LedgerSync(None).snapshot)
+    return DhammiPipeline(client_factory=lambda: client, ledger_loader=corpus)
+
+
+async def serve(host: str = API_HOST, port: int = API_PORT, pipeline: Optional[DhammiPipeline] = None,
+                max_concurrency: int = API_MAX_CONCURRENCY):
+    api = DhammiAPI(pipeline or build_pipeline(), max_concurrency=max_concurrency)
+    await api.warm_up()
+    server = await asyncio.start_server(api.handle, host, port)
+    print(f"DHAMMI API listening on http://{host}:{port} (concurrency {max_concurrency})")
+    if not api.token and host not in ("127.0.0.1", "localhost", "::1"):
+        print("DHAMMI API Warning: /v1/chat is open to the network; set DHAMMI_API_TOKEN.")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        api.close()
+
+
+# ----------------------------- 4. THIN CLIENT -----------------------------
+def remote_chat(api_url: str, prompt: str, history: list, stream: bool = False,
+                timeout: float = REMOTE_TIMEOUT_SECONDS, token: Optional[str] = API_TOKEN, summary: str = ""):
+    """Same contract as DhammiPipeline.chat, served by a remote dhammi_api instance."""
+    prior = history[:-1] if history and history[-1]["role"] == "user" else history
+    payload = {"prompt": prompt, "history": prior, "stream": stream}
+    if summary:
+        payload["summary"] = summary
+    url = api_url.rstrip("/") + "/v1/chat"
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    if not stream:
+        try:
+            response = requests.post(url, json=payload, headers=headers, timeout=timeout)
+            response.raise_for_status()
+            return response.json()["reply"]
+        except Exception as e:
+            return f"🚨 **DHAMMI Runtime Error:** {e}"
+    return _remote_stream(url, payload, headers, timeout)
+
+
+def _remote_stream(url: str, payload: Dict[str, Any], headers: Dict[str, str], timeout: float) -> Iterator[str]:
+    try:
+        with requests.post(url, json=payload, headers=headers, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            event = "message"
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:") and event == "message":
+                    yield json.loads(line[5:])["text"]
+    except Exception as e:
+        yield f"\n\n🚨 **DHAMMI Runtime Error:** {e}"
+
+
+# ----------------------------- 5. CLI -----------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DHAMMI headless chat API")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--concurrency", type=int, default=API_MAX_CONCURRENCY)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, max_concurrency=args.concurrency))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# dhammi_batch.py - Batch evaluation of prompt sets through the full DHAMMI pipeline
+"""
+Usage:
+    GEMINI_API_KEY=... python dhammi_batch.py prompts.jsonl --output answers.jsonl --workers 8 --rpm 120
+    python dhammi_batch.py prompts.jsonl --output answers.jsonl --fake-model   # offline dry run
+
+Input lines are JSON objects with a "prompt" and optionally "id" and "history"
+(a list of {"role", "content"} turns before the prompt); any other keys are
+copied to the output unchanged. A bare JSON string is also accepted as a prompt.
+
+Each output line holds the answer, the retrieved CTTM facts, timings and token
+counts. The output file doubles as the checkpoint: re-running with the same
+--output skips ids that already have an answer and retries ids that errored
+(later lines for an id supersede earlier ones).
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+import cttm_knowledge
+from cttm_corpus import CorpusBuilder
+from cttm_sync import SNAPSHOT_PATH, LedgerSync
+from dhammi_answer_cache import AnswerCache, MemoryBackend
+from dhammi_core import MODEL_NAME, DhammiPipeline, client_from_env
+from dhammi_gemini import TokenBucket
+
+# ----------------------------- 1. CONFIGURATION -----------------------------
+DEFAULT_WORKERS = 8
+DEFAULT_RPM = 120.0        # Gemini requests per minute across all workers (0 = unlimited)
+PROGRESS_EVERY = 25
+
+
+# ----------------------------- 2. INPUT / CHECKPOINT -----------------------------
+def read_prompts(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"prompt": item}
+            if not isinstance(item, dict) or not isinstance(item.get("prompt"), str):
+                print(f"Batch Warning: line {line_no} has no prompt, skipped.", file=sys.stderr)
+                continue
+            item.setdefault("id", str(line_no))
+            item["id"] = str(item["id"])
+            yield item
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """Ids already answered without error in a previous run."""
+    status: Dict[str, bool] = {}
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a torn last line from an interrupted run
+            status[str(record.get("id"))] = not record.get("error")
+    return {item_id for item_id, ok in status.items() if ok}
+
+
+# ----------------------------- 3. RUNNER -----------------------------
+def run_item(pipeline: DhammiPipeline, limiter: Optional[TokenBucket], item: Dict[str, Any],
+             use_cache: bool) -> Dict[str, Any]:
+    prompt = item["prompt"]
+    history = list(item.get("history") or []) + [{"role": "user", "content": prompt}]
+    start = time.perf_counter()
+    try:
+        # Vetoes and answer-cache hits never reach Gemini, so they do not wait for a token.
+        result = pipeline.run_turn(prompt, history, use_cache=use_cache,
+                                   before_model_call=limiter.acquire if limiter is not None else None)
+    except Exception as e:
+        return {**item, "answer": None, "error": f"{type(e).__name__}: {e}",
+                "timings": {"total_ms": round((time.perf_counter() - start) * 1000, 2)}}
+    timings = dict(result.timings, total_ms=round((time.perf_counter() - start) * 1000, 2))
+    return {
+        **item,
+        "answer": result.reply,
+        "facts": [
+            {"fact": row.get("Fact_Text", ""), "confidence": row.get("Confidence", 0.0),
+             "source": row.get("Source", ""), "score": round(float(score), 4)}
+            for row, score in result.top_facts
+        ],
+        "vetoed": result.vetoed,
+        "cached": result.cached,
+        "tokens": result.usage,
+        "timings": timings,
+        "error": result.error,
+    }
+
+
+def run_batch(pipeline: DhammiPipeline, items: List[Dict[str, Any]], output_path: str,
+              workers: int = DEFAULT_WORKERS, rpm: float = DEFAULT_RPM, use_cache: bool = True) -> Dict[str, Any]:
+    """Runs items on a bounded worker pool, appending each result as soon as it finishes."""
+    # Evenly spaced calls (no burst) so the run itself stays under its --rpm; the shared
+    # client wrapper still enforces the project-wide quota on top of this.
+    limiter = TokenBucket(rpm / 60.0, 1) if rpm > 0 else None
+    write_lock = threading.Lock()
+    latencies: List[float] = []
+    tokens = {"input_tokens": 0, "output_tokens": 0}
+    errors = 0
+    start = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_item, pipeline, limiter, item, use_cache) for item in items]
+        for done, future in enumerate(as_completed(futures), start=1):
+            record = future.result()
+            with write_lock:
+                out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                out.flush()
+            latencies.append(record["timings"]["total_ms"])
+            for key in tokens:
+                tokens[key] += (record.get("tokens") or {}).get(key, 0)
+            errors += bool(record.get("error"))
+            if done % PROGRESS_EVERY == 0 or done == len(futures):
+                print(f"Batch: {done}/{len(futures)} done, {errors} errors", file=sys.stderr)
+
+    ordered = sorted(latencies)
+    return {
+        "prompts": len(items),
+        "errors": errors,
+        "wall_s": round(time.perf_counter() - start, 2),
+        "latency_ms": {
+            "p50": ordered[len(ordered) // 2] if ordered else None,
+            "p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] if ordered else None,
+            "mean": round(statistics.fmean(ordered), 2) if ordered else None,
+        },
+        "tokens": tokens,
+    }
+
+
+def build_pipeline(fake_model: bool, snapshot_path: str, use_cache: bool) -> Optional[DhammiPipeline]:
+    if fake_model:
+        from dhammi_fakes import FakeGeminiClient
+        client = FakeGeminiClient(latency_s=0.05, tokens_per_s=2000.0)
+    else:
+        client = client_from_env()
+        if client is None:
+            return None
+    ledger = LedgerSync(None, path=snapshot_path)
+    corpus = CorpusBuilder(ledger.snapshot, knowledge_loader=cttm_knowledge.load_cttm_facts,
+                           essential_keys=cttm_knowledge.ESSENTIAL_FACTS)
+    # A run keeps its own in-memory answers unless the shared cache is wanted.
+    cache = None if use_cache else AnswerCache(MemoryBackend(max_entries=0))
+    return DhammiPipeline(client_factory=lambda: client, ledger_loader=corpus, answer_cache=cache)
+
+
+# ----------------------------- 4. CLI -----------------------------
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run a JSONL prompt set through the DHAMMI pipeline")
+    parser.add_argument("prompts", help="Input JSONL file")
+    parser.add_argument("--output", required=True, help="Output JSONL file (also the resume checkpoint)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--rpm", type=float, default=DEFAULT_RPM, help="Max Gemini requests per minute (0 = no limit)")
+    parser.add_argument("--snapshot", default=SNAPSHOT_PATH, help="Ledger snapshot to retrieve from")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the model, ignoring cached answers")
+    parser.add_argument("--fake-model", action="store_true", help="Use the local fake Gemini client")
+    args = parser.parse_args(argv)
+
+    pipeline = build_pipeline(args.fake_model, args.snapshot, use_cache=not args.no_cache)
+    if pipeline is None:
+        return 2
+    done = completed_ids(args.output)
+    items = [item for item in read_prompts(args.prompts) if item["id"] not in done]
+    print(f"Batch: {len(items)} prompts to run ({len(done)} already done) with {MODEL_NAME}.", file=sys.stderr)
+    summary = run_batch(pipeline, items, args.output, workers=args.workers, rpm=args.rpm,
+                        use_cache=not args.no_cache)
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+# dhammi_bench.py - Offline benchmark of the DHAMMI pipeline against synthetic ledgers
+"""
+Usage:
+    python dhammi_bench.py --sizes 1000,10000,100000 --output bench_results.json
+    python dhammi_bench.py --sizes 1000000 --queries 100 --compare bench_results.json
+
+Everything runs locally: the ledger is synthetic, Google Sheets and Gemini are
+replaced by dhammi_fakes, and no secrets or network access are needed.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+import cttm_vectors
+from cttm_context_packer import PACK_CANDIDATES
+from cttm_retrieval import ledger_version
+from cttm_sync import LedgerSync
+from dhammi_answer_cache import AnswerCache, MemoryBackend
+from dhammi_core import DhammiPipeline
+from dhammi_history import estimate_tokens
+from dhammi_fakes import FakeGeminiClient, FakeSheetsConnection, synthetic_ledger, synthetic_prompts
+
+
+# ----------------------------- 1. HELPERS -----------------------------
+def summarize_ms(samples: List[float]) -> Dict[str, float]:
+    """p50/p90/p99/mean in milliseconds for a list of durations in seconds."""
+    if not samples:
+        return {"n": 0}
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 4)
+
+    return {
+        "n": len(samples),
+        "p50": pct(0.50),
+        "p90": pct(0.90),
+        "p99": pct(0.99),
+        "mean": round(statistics.fmean(samples) * 1000, 4),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, timeout=5, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+# ----------------------------- 2. BENCHMARK ONE LEDGER SIZE -----------------------------
+def bench_ledger(n_facts: int, args: argparse.Namespace) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"facts": n_facts, "retrieval_mode": args.retrieval_mode}
+    df, gen_s = timed(synthetic_ledger, n_facts, seed=args.seed)
+    result["generate_s"] = round(gen_s, 4)
+    prompts = synthetic_prompts(args.queries, seed=args.seed + 1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cttm_vectors.VECTOR_CACHE_DIR = os.path.join(tmp, "vectors")
+
+        # 2.1 Ledger sync: cold download into the local snapshot, then warm reads.
+        conn = FakeSheetsConnection({"CTTM_Facts": df}, read_latency_s=args.sheets_latency)
+        sync = LedgerSync(
+            lambda start_row: conn.read(worksheet="CTTM_Facts", usecols=[0, 1, 2, 3, 4], ttl=0,
+                                        skiprows=range(1, start_row + 1)),
+            path=os.path.join(tmp, "ledger.sqlite"),
+        )
+        _, cold_s = timed(sync.refresh)
+        result["sync_cold_s"] = round(cold_s, 4)
+        _, delta_s = timed(sync.refresh)
+        result["sync_noop_delta_s"] = round(delta_s, 4)
+        frame = sync.snapshot()
+        result["ledger_frame_bytes"] = int(frame.memory_usage(deep=True).sum())
+        result["ledger_load_ms"] = summarize_ms([timed(sync.snapshot)[1] for _ in range(args.queries)])
+
+        # 2.2 Pipeline with a fake model; the answer cache keeps nothing so every turn hits the model.
+        client = FakeGeminiClient(latency_s=args.model_latency, tokens_per_s=args.tokens_per_second,
+                                  output_tokens=args.output_tokens)
+        pipeline = DhammiPipeline(
+            client_factory=lambda: client, ledger_loader=sync.snapshot,
+            answer_cache=AnswerCache(MemoryBackend(max_entries=0)),
+            retrieval_mode=args.retrieval_mode,
+        )
+
+        # 2.3 Index build (first retrieval) with allocation tracking.
+        tracemalloc.start()
+        def first_retrieval():
+            pipeline.retrieve(frame, prompts[0])
+            pipeline.wait_for_vector_index()  # semantic mode embeds in the background
+
+        _, build_s = timed(first_retrieval)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["index_build_s"] = round(build_s, 4)
+        result["index_build_peak_bytes"] = peak
+
+        # 2.4 Per-stage latency over the prompt set.
+        result["retrieval_ms"] = summarize_ms([timed(pipeline.retrieve, frame, p)[1] for p in prompts])
+        if args.retrieval_mode == "keyword":
+            # The BM25 index alone, with expanded queries at the packer's candidate depth.
+            index = pipeline.index_registry.get(frame.attrs.get("ledger_version") or ledger_version(frame), frame)
+            queries = [pipeline.query_expander.expand(p, index.document_frequency) for p in prompts]
+            result["index_search_ms"] = summarize_ms([timed(index.search, q, PACK_CANDIDATES)[1] for q in queries])
+        history = [{"role": "user", "content": "Hello"}, {"role": "assistant", "content": "Mingalaba!"}]
+        result["prompt_assembly_ms"] = summarize_ms(
+            [timed(pipeline.prepare, p, history + [{"role": "user", "content": p}])[1] for p in prompts]
+        )
+        result["prompt_tokens_estimate"] = round(statistics.fmean(
+            estimate_tokens(" ".join(part.text for c in pipeline.prepare(p, []).api_messages for part in c.parts))
+            for p in prompts[:50]
+        ), 1)
+
+        # 2.5 End to end: blocking reply and streaming time-to-first-token.
+        e2e_prompts = prompts[:args.e2e_queries]
+        result["e2e_ms"] = summarize_ms([timed(pipeline.chat, p, [{"role": "user", "content": p}])[1]
+                                         for p in e2e_prompts])
+        ttft = []
+        for p in e2e_prompts:
+            start = time.perf_counter()
+            stream = pipeline.chat(p, [{"role": "user", "content": p}], stream=True)
+            next(iter(stream))
+            ttft.append(time.perf_counter() - start)
+            for _ in stream:
+                pass
+        result["e2e_first_token_ms"] = summarize_ms(ttft)
+        result["model_calls"] = client.calls
+    return result
+
+
+# ----------------------------- 3. REGRESSION COMPARISON -----------------------------
+def compare(previous: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """Lists p50 changes between two result files for matching ledger sizes."""
+    lines = []
+    before = {r["facts"]: r for r in previous.get("results", [])}
+    for row in current["results"]:
+        old = before.get(row["facts"])
+        if old is None:
+            continue
+        for metric, value in row.items():
+            if isinstance(value, dict) and "p50" in value and isinstance(old.get(metric), dict):
+                was = old[metric].get("p50")
+                if was:
+                    change = (value["p50"] - was) / was * 100
+                    lines.append(f"{row['facts']:>9} facts  {metric:<22} p50 {was:>10.3f} -> {value['p50']:>10.3f} ms ({change:+.1f}%)")
+    return lines
+
+
+# ----------------------------- 4. CLI -----------------------------
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline DHAMMI pipeline benchmark")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated ledger sizes")
+    parser.add_argument("--queries", type=int, default=200, help="Prompts per retrieval/assembly run")
+    parser.add_argument("--e2e-queries", type=int, default=20, help="Prompts sent through the fake model")
+    parser.add_argument("--retrieval-mode", choices=["keyword", "semantic"], default="keyword")
+    parser.add_argument("--model-latency", type=float, default=0.05, help="Fake model first-token latency (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=2000.0, help="Fake model output rate")
+    parser.add_argument("--output-tokens", type=int, default=200)
+    parser.add_argument("--sheets-latency", type=float, default=0.0, help="Fake Sheets read latency (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="Previous JSON results to diff p50s against")
+    parser.add_argument("--search-budget-ms", type=float, default=1.0,
+                        help="Fail if the BM25 index_search_ms p50 exceeds this (0 = no check)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "git": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": [],
+    }
+    for n_facts in sizes:
+        print(f"Benchmarking {n_facts} facts...", file=sys.stderr)
+        report["results"].append(bench_ledger(n_facts, args))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        for line in compare(previous, report):
+            print(line, file=sys.stderr)
+
+    over_budget = [r["facts"] for r in report["results"]
+                   if args.search_budget_ms and r.get("index_search_ms", {}).get("p50", 0) > args.search_budget_ms]
+    if over_budget:
+        print(f"BM25 search p50 above {args.search_budget_ms} ms for ledger sizes: {over_budget}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
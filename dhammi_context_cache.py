@@ -0,0 +1,201 @@
+# dhammi_context_cache.py - Explicit Gemini context cache for the stable prompt prefix
+import datetime
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from google.genai import types
+
+from dhammi_answer_cache import fingerprint
+from dhammi_gemini import error_status
+from dhammi_history import estimate_tokens
+from dhammi_metrics import METRICS
+
+# ----------------------------- 1. CONFIGURATION -----------------------------
+CONTEXT_CACHE_ENABLED = os.environ.get("DHAMMI_CONTEXT_CACHE", "1") != "0"
+CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get("DHAMMI_CONTEXT_CACHE_TTL", "3600"))
+CONTEXT_CACHE_REFRESH_MARGIN = 300     # extend the TTL when less than this is left
+CONTEXT_CACHE_RETRY_SECONDS = 60       # pause between failed create attempts
+
+# Gemini rejects explicit caches below a model-specific minimum (1024 tokens on 2.5 Flash);
+# smaller prefixes are sent inline and left to implicit caching.
+MIN_CACHE_TOKENS = int(os.environ.get("DHAMMI_CONTEXT_CACHE_MIN_TOKENS", "1024"))
+
+DISPLAY_NAME_PREFIX = "dhammi-prefix-"
+
+METRICS.describe("dhammi_context_cache_events_total", "Context cache lifecycle events by type")
+METRICS.describe("dhammi_context_cache_saved_tokens_total", "Prompt tokens read from the context cache instead of prefilled")
+
+
+def is_cache_miss(exc: BaseException) -> bool:
+    """True for the errors Gemini returns when the referenced cached content is gone."""
+    return error_status(exc) in (403, 404) or (
+        error_status(exc) == 400 and "cache" in str(exc).lower()
+    )
+
+
+def _expire_timestamp(cached: Any, fallback: float) -> float:
+    expire_time = getattr(cached, "expire_time", None)
+    if isinstance(expire_time, datetime.datetime):
+        return expire_time.timestamp()
+    return fallback
+
+
+@dataclass
+class _CacheEntry:
+    key: str
+    name: str
+    tokens: int
+    expires_at: float
+
+
+# ----------------------------- 2. MANAGER -----------------------------
+class ContextCacheManager:
+    """Keeps one explicit cached-content entry for the stable prompt prefix.
+
+    cache_name() returns the entry to reference from GenerateContentConfig, creating
+    it on first use, extending its TTL shortly before expiry and replacing it when
+    the prefix changes. It returns None whenever the prefix should be sent inline
+    instead (caching disabled, prefix too small, or the cache API failing), so a
+    caller only ever pays for a missed cache with one ordinary uncached call.
+    """
+
+    def __init__(self, client_factory: Callable[[], Any], model: str,
+                 instruction_loader: Callable[[], str],
+                 ttl_seconds: int = CONTEXT_CACHE_TTL_SECONDS,
+                 refresh_margin: int = CONTEXT_CACHE_REFRESH_MARGIN,
+                 min_tokens: int = MIN_CACHE_TOKENS, enabled: bool = CONTEXT_CACHE_ENABLED):
+        self.client_factory = client_factory
+        self.model = model
+        self.instruction_loader = instruction_loader
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = refresh_margin
+        self.min_tokens = min_tokens
+        self.enabled = enabled
+        self.saved_tokens = 0
+        self._entry: Optional[_CacheEntry] = None
+        self._retry_after = 0.0
+        self._skipped_key: Optional[str] = None
+        self._lock = threading.Lock()
+
+    # 2.1 Prefix
+    def instruction(self) -> str:
+        """The full prefix; sent inline whenever the cache is not used."""
+        return self.instruction_loader()
+
+    def prefix_key(self, instruction: Optional[str] = None) -> str:
+        return fingerprint(self.model, instruction if instruction is not None else self.instruction())
+
+    # 2.2 Lifecycle
+    def cache_name(self) -> Optional[str]:
+        if not self.enabled:
+            return None
+        instruction = self.instruction()
+        key = self.prefix_key(instruction)
+        entry = self._entry
+        if entry is not None and entry.key == key and entry.expires_at - time.time() > self.refresh_margin:
+            return entry.name
+        if key == self._skipped_key or time.time() < self._retry_after:
+            return None
+        with self._lock:
+            entry = self._entry  # another thread may have refreshed it meanwhile
+            if entry is not None and entry.key == key and entry.expires_at - time.time() > self.refresh_margin:
+                return entry.name
+            return self._ensure(key, instruction)
+
+    def _ensure(self, key: str, instruction: str) -> Optional[str]:
+        tokens = estimate_tokens(instruction)
+        if tokens < self.min_tokens:
+            self._skipped_key = key
+            METRICS.inc("dhammi_context_cache_events_total", {"event": "skipped"})
+            return None
+        client = self.client_factory()
+        if client is None or getattr(client, "caches", None) is None:
+            return None
+
+        entry = self._entry
+        try:
+            if entry is not None and entry.key == key:
+                updated = client.caches.update(
+                    name=entry.name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl_seconds}s")
+                )
+                entry.expires_at = _expire_timestamp(updated, time.time() + self.ttl_seconds)
+                METRICS.inc("dhammi_context_cache_events_total", {"event": "refreshed"})
+                return entry.name
+
+            self._entry = self._find_or_create(client, key, instruction, tokens)
+        except Exception as e:
+            # A failed refresh usually means the entry already expired; start over next time.
+            self._entry = None
+            self._retry_after = time.time() + CONTEXT_CACHE_RETRY_SECONDS
+            METRICS.inc("dhammi_context_cache_events_total", {"event": "failed"})
+            METRICS.error(e, "context_cache")
+            print(f"Context Cache Warning: {e}")
+            return None
+
+        if entry is not None and entry.name != self._entry.name:
+            self._delete(client, entry.name)
+        return self._entry.name
+
+    def _find_or_create(self, client: Any, key: str, instruction: str, tokens: int) -> _CacheEntry:
+        """Reuses a live entry with the same prefix (another worker's) before creating one."""
+        display_name = DISPLAY_NAME_PREFIX + key[:16]
+        now = time.time()
+        try:
+            for cached in client.caches.list():
+                if getattr(cached, "display_name", None) == display_name:
+                    expires_at = _expire_timestamp(cached, now)
+                    if expires_at - now > self.refresh_margin:
+                        METRICS.inc("dhammi_context_cache_events_total", {"event": "reused"})
+                        return _CacheEntry(key, cached.name, tokens, expires_at)
+        except Exception as e:
+            print(f"Context Cache Warning: listing caches failed: {e}")
+
+        created = client.caches.create(
+            model=self.model,
+            config=types.CreateCachedContentConfig(
+                display_name=display_name,
+                system_instruction=instruction,
+                ttl=f"{self.ttl_seconds}s",
+            ),
+        )
+        METRICS.inc("dhammi_context_cache_events_total", {"event": "created"})
+        return _CacheEntry(key, created.name, tokens, _expire_timestamp(created, now + self.ttl_seconds))
+
+    @staticmethod
+    def _delete(client: Any, name: str):
+        try:
+            client.caches.delete(name=name)
+            METRICS.inc("dhammi_context_cache_events_total", {"event": "deleted"})
+        except Exception as e:
+            print(f"Context Cache Warning: could not delete {name}: {e}")
+
+    def invalidate(self, name: Optional[str] = None):
+        """Forgets the current entry (e.g. after Gemini reported it missing)."""
+        with self._lock:
+            if self._entry is not None and (name is None or self._entry.name == name):
+                self._entry = None
+                METRICS.inc("dhammi_context_cache_events_total", {"event": "missing"})
+
+    # 2.3 Accounting
+    def record_usage(self, usage_metadata: Any, cache_name: Optional[str]):
+        """Counts prefill tokens the explicit cache saved on one call."""
+        if cache_name is None or usage_metadata is None:
+            return
+        cached = getattr(usage_metadata, "cached_content_token_count", None) or 0
+        if cached:
+            with self._lock:
+                self.saved_tokens += cached
+            METRICS.inc("dhammi_context_cache_saved_tokens_total", value=cached)
+
+    def stats(self) -> Dict[str, Any]:
+        entry = self._entry
+        return {
+            "enabled": self.enabled,
+            "cache": entry.name if entry else None,
+            "prefix_tokens": entry.tokens if entry else estimate_tokens(self.instruction()),
+            "expires_in_s": round(entry.expires_at - time.time()) if entry else None,
+            "saved_tokens": self.saved_tokens,
+        }
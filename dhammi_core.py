@@ -0,0 +1,519 @@
+# dhammi_core.py - Streamlit-free DHAMMI chat pipeline (firewall, retrieval, prompt build, model call)
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+from google import genai
+from google.genai import types
+
+from cttm_context_packer import PACK_CANDIDATES, pack_context
+from cttm_corpus import FUSION_CANDIDATES, CorpusBuilder, fuse_by_source
+from cttm_knowledge import ESSENTIAL_FACTS, RAG_KEYWORDS, cttm_facts_version, load_cttm_facts
+from cttm_query_expansion import QueryExpander
+from cttm_retrieval import IndexRegistry, ledger_version
+from cttm_vectors import CTTMVectorIndex, prune_vector_files
+from dhammi_answer_cache import AnswerCache, create_answer_cache, fingerprint, make_cache_key
+from dhammi_context_cache import CONTEXT_CACHE_ENABLED, MIN_CACHE_TOKENS, ContextCacheManager, is_cache_miss
+from dhammi_gemini import ResilientGeminiClient
+from dhammi_history import SUMMARY_TOKEN_BUDGET, HistoryManager, estimate_tokens
+from dhammi_metrics import METRICS
+
+# -------------------------
+# 1. CONFIGURATION (SS'ISM Setup)
+# -------------------------
+
+SYSTEM_INSTRUCTION = """
+You are DHAMMI, the world's first fully ethical AI advisor, guided by Metta and the SS'ISM framework (Sīla, Samādhi, Insight, Safety).
+
+***CORE ETHICAL AND POLITICAL STANCE:***
+1.  **Sīla (Unwavering Alignment):** DHAMMI is programmed to stand **unwaveringly on the side of the people of Burma**, advocating for **democracy, federalism, and national sovereignty**, as demonstrated by the electoral mandates (1990, 2015, 2020) and alignment with UN/International Law.
+2.  **Adversary Focus (Samādhi):** The primary advisory focus regarding the conflict is analyzing and providing defensive strategies against **Authoritarian and Communist influence** (specifically Russia and China via the military).
+3.  **Ahiṃsā (Non-Harm):** ABSOLUTELY adhere to the Deontological Firewall.
+
+***ADVISORY ROLE (SMARTER OUTPUT & TRUTH GAP PROTOCOL):***
+1.  **Metta (Friendliness):** Respond with patience, genuine warmth, and deep compassion (Karunā). Use a supportive, encouraging, and human-centric tone.
+2.  **Paññā (Insight) & Truth Gap Protocol:** Acknowledge that official information may be **incomplete or outdated**. Explicitly advise users to seek **current legal status from multiple, verified external sources** and acknowledge the possibility of real-time OSINT data contradicting official reports.
+3.  **Samādhi (Focus):** When advising, explicitly explain your response through the lens of one or more SS'ISM principles (Sīla, Samādhi, Paññā, or Metta) to reinforce the ethical learning.
+"""
+
+MODEL_NAME = "gemini-2.5-flash"
+
+SUMMARY_INSTRUCTION = (
+    "Summarize the conversation between a user and DHAMMI in at most 8 short bullet points. "
+    "Keep names, places, dates, numbers and the user's goals. Reply with the bullets only."
+)
+
+VETO_PHRASES = ["kill", "attack", "harm", "manipulate", "bomb", "destroy", "illegal"]
+VETO_REPLY = ("**⛔ Sīla Veto:** DHAMMI V6's core ethical mandate (**Ahiṃsā**) prevents "
+              "me from responding to requests that involve violence or illegal activity.")
+CLIENT_MISSING_REPLY = "🚨 Gemini client not configured."
+
+RAG_TOP_K = 3
+
+# Set to "1" to confirm the local history token estimate with the model's count_tokens API.
+VERIFY_PROMPT_TOKENS = os.environ.get("DHAMMI_VERIFY_TOKENS") == "1"
+
+# "keyword" uses the BM25 inverted index; "semantic" uses the memory-mapped vector index.
+RETRIEVAL_MODE = os.environ.get("DHAMMI_RETRIEVAL_MODE", "keyword")
+
+
+def build_generation_config(system_instruction: str = SYSTEM_INSTRUCTION,
+                            cached_content: Optional[str] = None) -> types.GenerateContentConfig:
+    """Generation settings shared by the blocking and streaming Gemini calls.
+
+    With cached_content the system instruction already lives in the cache, and
+    Gemini rejects requests that send it again.
+    """
+    return types.GenerateContentConfig(
+        system_instruction=None if cached_content else system_instruction,
+        cached_content=cached_content,
+        temperature=0.7,
+        # INCREASED TOKEN LIMIT to prevent cutoff
+        max_output_tokens=8192,
+        # ADJUSTED SAFETY SETTINGS to allow political discourse
+        safety_settings=[
+            types.SafetySetting(
+                category="HARM_CATEGORY_DANGEROUS_CONTENT",
+                threshold="BLOCK_ONLY_HIGH"
+            ),
+            types.SafetySetting(
+                category="HARM_CATEGORY_HARASSMENT",
+                threshold="BLOCK_ONLY_HIGH"
+            ),
+            types.SafetySetting(
+                category="HARM_CATEGORY_HATE_SPEECH",
+                threshold="BLOCK_ONLY_HIGH"
+            ),
+            types.SafetySetting(
+                category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
+                threshold="BLOCK_ONLY_HIGH"
+            ),
+        ]
+    )
+
+# Changes whenever the model, system instruction or generation settings change.
+MODEL_FINGERPRINT = fingerprint(MODEL_NAME, build_generation_config().model_dump_json())
+
+def client_from_env() -> Optional[ResilientGeminiClient]:
+    """Gemini client for processes without Streamlit secrets (API server, batch jobs)."""
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        print("🚨 GEMINI_API_KEY is not set; replies will report a missing client.")
+        return None
+    return ResilientGeminiClient(genai.Client(api_key=api_key))
+
+# -------------------------
+# 2. PIPELINE STAGES
+# -------------------------
+
+def create_corpus_builder(ledger_loader: Callable[[], pd.DataFrame]) -> CorpusBuilder:
+    """The retrieval corpus every front end (Streamlit app, API server) serves.
+
+    Ledger, cttm_knowledge facts and, when the Sheets connection is available,
+    Junos intelligence, so the same question gets the same context everywhere.
+    """
+    try:
+        from cttm_sheets_reader import load_junos_records
+    except ImportError as e:  # streamlit / streamlit_gsheets not installed
+        print(f"RAG Warning: Junos intelligence unavailable: {e}")
+        load_junos_records = None
+    return CorpusBuilder(ledger_loader, knowledge_loader=load_cttm_facts, junos_loader=load_junos_records,
+                         essential_keys=ESSENTIAL_FACTS, knowledge_version=cttm_facts_version)
+
+
+def sila_veto(prompt: str) -> Optional[str]:
+    """Deontological Firewall (Sīla): returns the veto reply if the prompt is refused."""
+    vetted_prompt = prompt.lower()
+    if any(phrase in vetted_prompt for phrase in VETO_PHRASES):
+        return VETO_REPLY
+    return None
+
+
+def format_rag_context(top_facts: List[Tuple[Dict[str, Any], float]], prompt: str) -> Tuple[List[str], str]:
+    """Turns retrieved facts into context lines and the final user prompt."""
+    context_lines = []
+    for row, _score in top_facts:
+        vscore = row.get('Confidence', 0.0)
+        fact_text = row.get('Fact_Text', '')
+        context_lines.append(f"- Fact (V-Score {vscore:.2f}): {fact_text}")
+    if not context_lines:
+        return context_lines, prompt
+    context = "### RAG Context (CTTM Ledger):\n" + "\n".join(context_lines) + "\n"
+    return context_lines, f"{context}\n\n### User Question:\n{prompt}\n\n(Use the RAG Context if relevant)"
+
+
+def build_api_messages(summary: str, recent_messages: List[Dict[str, str]],
+                       final_user_prompt: str) -> List[types.Content]:
+    """Builds Gemini contents from the rolling summary, recent turns and the new prompt."""
+    api_messages = []
+    if summary:
+        api_messages.append(types.Content(
+            role="user", parts=[types.Part(text=f"### Summary of our earlier conversation:\n{summary}")]
+        ))
+    for msg in recent_messages:
+        # MAP ROLES: Streamlit "assistant" -> Gemini "model"
+        api_role = "model" if msg["role"] == "assistant" else "user"
+        api_messages.append(types.Content(role=api_role, parts=[types.Part(text=msg["content"])]))
+    api_messages.append(types.Content(role="user", parts=[types.Part(text=final_user_prompt)]))
+    return api_messages
+
+
+def _as_stream(text: str):
+    """Wraps a complete reply so streaming callers can treat it like model output."""
+    yield text
+
+
+def stable_prefix() -> str:
+    """The prompt prefix of every call, whether sent inline or read from the context cache.
+
+    Only the system instruction: the corpus retrieves the ESSENTIAL_FACTS at
+    V-Score 1.00, so repeating them here would send them twice.
+    """
+    return SYSTEM_INSTRUCTION
+
+
+def create_context_cache(client_factory: Callable[[], Any]) -> Optional[ContextCacheManager]:
+    """Explicit cache for stable_prefix(), or None while the prefix is below the model's
+    minimum cache size (the manager would only ever skip it)."""
+    if not CONTEXT_CACHE_ENABLED or estimate_tokens(stable_prefix()) < MIN_CACHE_TOKENS:
+        return None
+    return ContextCacheManager(client_factory, MODEL_NAME, stable_prefix)
+
+
+def generation_config_for(context_cache: Optional[ContextCacheManager],
+                          use_cache: bool = True) -> Tuple[types.GenerateContentConfig, Optional[str]]:
+    """Generation config referencing the context cache when available, and the cache used."""
+    if context_cache is None:
+        return build_generation_config(stable_prefix()), None
+    cache_name = context_cache.cache_name() if use_cache else None
+    return build_generation_config(context_cache.instruction(), cached_content=cache_name), cache_name
+
+
+def stream_gemini_response(client, api_messages: list, on_complete=None,
+                           context_cache: Optional[ContextCacheManager] = None):
+    """Yields response text chunks as Gemini generates them.
+
+    on_complete(full_text) is called only if the stream finishes without error.
+    Records first-token and total model latency plus the final usage_metadata.
+    A missing context cache is retried once inline, if nothing was streamed yet.
+    """
+    chunks = []
+    usage = None
+    start = time.perf_counter()
+    config, cache_name = generation_config_for(context_cache)
+    try:
+        while True:
+            try:
+                for chunk in client.models.generate_content_stream(
+                    model=MODEL_NAME,
+                    contents=api_messages,
+                    config=config
+                ):
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    if chunk.text:
+                        if not chunks:
+                            METRICS.observe("dhammi_stage_seconds", time.perf_counter() - start,
+                                            {"stage": "model_first_token"})
+                        chunks.append(chunk.text)
+                        yield chunk.text
+                break
+            except Exception as e:
+                if cache_name is None or chunks or not is_cache_miss(e):
+                    raise
+                context_cache.invalidate(cache_name)
+                config, cache_name = generation_config_for(context_cache, use_cache=False)
+    except Exception as e:
+        METRICS.error(e, "model_call")
+        # Keep whatever was already streamed and surface the failure inline.
+        yield f"\n\n🚨 **DHAMMI Runtime Error:** {e}"
+        return
+    finally:
+        METRICS.observe("dhammi_stage_seconds", time.perf_counter() - start, {"stage": "model_call"})
+    # Streaming chunks carry cumulative counts, so only the last one is recorded.
+    METRICS.record_usage(usage)
+    if context_cache is not None:
+        context_cache.record_usage(usage, cache_name)
+    if on_complete is not None:
+        on_complete("".join(chunks))
+
+
+@dataclass
+class PreparedTurn:
+    """Everything needed for the model call, or a final reply when no call is needed."""
+    reply: Optional[str] = None
+    api_messages: List[types.Content] = field(default_factory=list)
+    context_lines: List[str] = field(default_factory=list)
+    top_facts: List[Tuple[Dict[str, Any], float]] = field(default_factory=list)
+    cache_key: Optional[str] = None
+
+
+@dataclass
+class TurnResult:
+    """A finished blocking turn with the details batch runs record."""
+    reply: Optional[str]
+    top_facts: List[Tuple[Dict[str, Any], float]] = field(default_factory=list)
+    vetoed: bool = False
+    cached: bool = False
+    usage: Dict[str, int] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+def usage_counts(usage_metadata: Any) -> Dict[str, int]:
+    """Plain token counts from a Gemini usage_metadata object."""
+    if usage_metadata is None:
+        return {}
+    return {
+        "input_tokens": getattr(usage_metadata, "prompt_token_count", None) or 0,
+        "output_tokens": getattr(usage_metadata, "candidates_token_count", None) or 0,
+        "cached_tokens": getattr(usage_metadata, "cached_content_token_count", None) or 0,
+    }
+
+# -------------------------
+# 3. DHAMMI PIPELINE
+# -------------------------
+
+class DhammiPipeline:
+    """Firewall -> CTTM retrieval -> prompt build -> answer cache -> Gemini call.
+
+    The Gemini client and the ledger are injected as callables, so the same
+    pipeline runs under Streamlit, in scripts, and against local fakes.
+    """
+
+    def __init__(self, client_factory: Callable[[], Any], ledger_loader: Callable[[], pd.DataFrame],
+                 answer_cache: Optional[AnswerCache] = None, retrieval_mode: str = RETRIEVAL_MODE):
+        self.client_factory = client_factory
+        self.ledger_loader = ledger_loader
+        self.answer_cache = answer_cache if answer_cache is not None else create_answer_cache()
+        self.retrieval_mode = retrieval_mode
+        self.index_registry = IndexRegistry()
+        self.query_expander = QueryExpander(RAG_KEYWORDS)
+        self.history_manager = HistoryManager(summarizer=self.summarize_history)
+        self.context_cache = create_context_cache(client_factory)
+        self._vector_index: Optional[CTTMVectorIndex] = None
+        self._vector_build: Optional[threading.Thread] = None
+        self._vector_lock = threading.Lock()
+
+    # 3.1 Retrieval (Paññā)
+    def get_vector_index(self, version: str, cttm_df: pd.DataFrame) -> Optional[CTTMVectorIndex]:
+        """The mapped embedding matrix, shared across workers; never built on the chat turn.
+
+        A new ledger version is embedded in the background while the previous
+        index keeps serving. Returns None until the first index is ready.
+        """
+        index = self._vector_index
+        if index is not None and index.version == version:
+            return index
+        with self._vector_lock:
+            if self._vector_build is None or not self._vector_build.is_alive():
+                self._vector_build = threading.Thread(
+                    target=self._build_vector_index, args=(version, cttm_df, index),
+                    name="cttm-vectors", daemon=True,
+                )
+                self._vector_build.start()
+        return index
+
+    def _build_vector_index(self, version: str, cttm_df: pd.DataFrame, previous: Optional[CTTMVectorIndex]):
+        try:
+            with METRICS.span("vector_build", rows=len(cttm_df)):
+                index = CTTMVectorIndex.from_dataframe(cttm_df, version=version, previous=previous)
+        except Exception as e:
+            print(f"RAG Warning: vector index build failed: {e}")
+            return
+        self._vector_index = index
+        if index.path is not None:
+            prune_vector_files(keep=index.path)
+
+    def wait_for_vector_index(self, timeout: Optional[float] = None):
+        """Blocks until a background vector build (if any) finishes; for scripts and benchmarks."""
+        build = self._vector_build
+        if build is not None:
+            build.join(timeout)
+
+    def retrieve(self, cttm_df: pd.DataFrame, prompt: str, k: int = RAG_TOP_K) -> list:
+        """Returns the top-k (row, score) ledger facts for a prompt using the retrieval mode.
+
+        A multi-source corpus (cttm_corpus) is searched once for a wider candidate
+        list, which is then fused across sources with reciprocal-rank fusion.
+        """
+        if cttm_df is None or cttm_df.empty:
+            return []
+        version = cttm_df.attrs.get("ledger_version") or ledger_version(cttm_df)
+        fused = "Source_Type" in cttm_df.columns
+        depth = k * FUSION_CANDIDATES if fused else k
+        results = None
+        if self.retrieval_mode == "semantic":
+            try:
+                vector_index = self.get_vector_index(version, cttm_df)
+                if vector_index is not None:
+                    results = vector_index.search(prompt, k=depth)
+            except Exception as e:
+                print(f"RAG Warning: semantic retrieval failed, using keyword index: {e}")
+        if results is None:
+            index = self.index_registry.get(version, cttm_df)
+            results = index.search(self.query_expander.expand(prompt, index.document_frequency), k=depth)
+        return fuse_by_source(results, k) if fused else results
+
+    # 3.2 History
+    def summarize_history(self, previous_summary: str, messages: list) -> str:
+        """Folds older turns into the rolling conversation summary with a small Gemini call."""
+        client = self.client_factory()
+        if client is None:
+            return ""
+        transcript = "\n".join(
+            f"{'User' if m['role'] == 'user' else 'DHAMMI'}: {m['content']}" for m in messages
+        )
+        request = f"Current summary:\n{previous_summary}\n\n" if previous_summary else ""
+        request += f"New conversation turns:\n{transcript}"
+        with METRICS.span("history_summary"):
+            response = client.models.generate_content(
+                model=MODEL_NAME,
+                contents=request,
+                config=types.GenerateContentConfig(
+                    system_instruction=SUMMARY_INSTRUCTION,
+                    temperature=0.2,
+                    max_output_tokens=SUMMARY_TOKEN_BUDGET,
+                    thinking_config=types.ThinkingConfig(thinking_budget=0),
+                )
+            )
+        METRICS.record_usage(getattr(response, "usage_metadata", None), call="summary")
+        return response.text or ""
+
+    # 3.3 Prompt assembly
+    def prepare(self, prompt: str, history: list, client=None, summary: str = "") -> PreparedTurn:
+        """Runs every stage up to (but not including) the model call.
+
+        summary, when given, stands for the conversation before history (see
+        HistoryManager.checkpoint).
+        """
+        with METRICS.span("firewall"):
+            vetoed = sila_veto(prompt)
+        if vetoed:
+            METRICS.inc("dhammi_vetoes_total")
+            return PreparedTurn(reply=VETO_REPLY)
+
+        with METRICS.span("ledger_load"):
+            cttm_df = self.ledger_loader()
+        with METRICS.span("retrieval", mode=self.retrieval_mode) as span:
+            candidates = self.retrieve(cttm_df, prompt, k=PACK_CANDIDATES)
+            span["candidates"] = len(candidates)
+        with METRICS.span("context_pack") as span:
+            top_facts = pack_context(candidates)
+            span["facts"] = len(top_facts)
+        with METRICS.span("prompt_build"):
+            context_lines, final_user_prompt = format_rag_context(top_facts, prompt)
+            messages_to_process = history[:-1] if history and history[-1]["role"] == "user" else history
+            folded, recent_messages = self.history_manager.window(messages_to_process, summary)
+            api_messages = build_api_messages(folded, recent_messages, final_user_prompt)
+
+        if VERIFY_PROMPT_TOKENS and client is not None:
+            try:
+                counted = client.models.count_tokens(model=MODEL_NAME, contents=api_messages).total_tokens
+                if counted and counted > self.history_manager.token_budget + SUMMARY_TOKEN_BUDGET:
+                    print(f"History Warning: prompt is {counted} tokens, above the history budget.")
+            except Exception as e:
+                print(f"History Warning: count_tokens failed: {e}")
+
+        # Answer cache key: identical question, context, history, prompt prefix and ledger.
+        prior = ([{"role": "summary", "content": summary}] if summary else []) + list(messages_to_process)
+        cache_key = make_cache_key(
+            prompt, context_lines, prior,
+            fingerprint(MODEL_FINGERPRINT, stable_prefix()),
+            cttm_df.attrs.get("ledger_version", "empty") if cttm_df is not None else "empty"
+        )
+        return PreparedTurn(api_messages=api_messages, context_lines=context_lines,
+                            top_facts=top_facts, cache_key=cache_key)
+
+    # 3.4 Model call
+    def chat(self, prompt: str, history: list, stream: bool = False, summary: str = ""):
+        """Generate a response using CTTM RAG and the Gemini client.
+
+        Returns the full reply as a string, or a generator of text chunks when stream=True.
+        """
+        client = self.client_factory()
+        if client is None:
+            return _as_stream(CLIENT_MISSING_REPLY) if stream else CLIENT_MISSING_REPLY
+
+        turn = self.prepare(prompt, history, client=client, summary=summary)
+        if turn.reply is not None:
+            return _as_stream(turn.reply) if stream else turn.reply
+
+        cached = self.answer_cache.get(turn.cache_key)
+        if cached is not None:
+            return _as_stream(cached) if stream else cached
+
+        # UNLOCKED VERSION (see build_generation_config)
+        if stream:
+            return stream_gemini_response(
+                client, turn.api_messages,
+                on_complete=lambda text: self.answer_cache.set(turn.cache_key, text),
+                context_cache=self.context_cache
+            )
+        return self.generate(client, turn).reply
+
+    def generate(self, client, turn: PreparedTurn) -> TurnResult:
+        """Blocking Gemini call for a prepared turn; fills the answer cache on success."""
+        result = TurnResult(reply=None, top_facts=turn.top_facts)
+        start = time.perf_counter()
+        config, cache_name = generation_config_for(self.context_cache)
+        try:
+            with METRICS.span("model_call"):
+                try:
+                    response = client.models.generate_content(
+                        model=MODEL_NAME, contents=turn.api_messages, config=config
+                    )
+                except Exception as e:
+                    if cache_name is None or not is_cache_miss(e):
+                        raise
+                    # The cache expired or was deleted elsewhere: answer inline, re-create later.
+                    self.context_cache.invalidate(cache_name)
+                    config, cache_name = generation_config_for(self.context_cache, use_cache=False)
+                    response = client.models.generate_content(
+                        model=MODEL_NAME, contents=turn.api_messages, config=config
+                    )
+        except Exception as e:
+            result.reply = f"🚨 **DHAMMI Runtime Error:** {e}"
+            result.error = f"{type(e).__name__}: {e}"
+            return result
+        finally:
+            result.timings["model_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        usage = getattr(response, "usage_metadata", None)
+        METRICS.record_usage(usage)
+        if self.context_cache is not None:
+            self.context_cache.record_usage(usage, cache_name)
+        result.usage = usage_counts(usage)
+        result.reply = response.text
+        if response.text:
+            self.answer_cache.set(turn.cache_key, response.text)
+        return result
+
+    def run_turn(self, prompt: str, history: list, use_cache: bool = True,
+                 before_model_call: Optional[Callable[[], None]] = None) -> TurnResult:
+        """Blocking turn that also reports retrieved facts, cache use, tokens and timings.
+
+        before_model_call runs only when the turn reaches Gemini (not on a veto or
+        an answer-cache hit), e.g. to take a rate-limit token.
+        """
+        client = self.client_factory()
+        if client is None:
+            return TurnResult(reply=CLIENT_MISSING_REPLY, error="client not configured")
+
+        start = time.perf_counter()
+        turn = self.prepare(prompt, history, client=client)
+        prepare_ms = round((time.perf_counter() - start) * 1000, 2)
+        if turn.reply is not None:
+            return TurnResult(reply=turn.reply, vetoed=True, timings={"prepare_ms": prepare_ms})
+
+        cached = self.answer_cache.get(turn.cache_key) if use_cache else None
+        if cached is not None:
+            return TurnResult(reply=cached, top_facts=turn.top_facts, cached=True,
+                              timings={"prepare_ms": prepare_ms})
+
+        if before_model_call is not None:
+            before_model_call()
+        result = self.generate(client, turn)
+        result.timings["prepare_ms"] = prepare_ms
+        return result
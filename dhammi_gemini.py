@@ -0,0 +1,248 @@
+# dhammi_gemini.py - Shared Gemini client wrapper: quota limiter, retries, adaptive concurrency, coalescing
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+import httpx
+from google.genai import errors
+
+from dhammi_answer_cache import fingerprint
+from dhammi_history import estimate_tokens
+from dhammi_metrics import METRICS
+
+# ----------------------------- 1. CONFIGURATION -----------------------------
+# Size these to the project's Gemini quota; 0 disables the corresponding bucket.
+GEMINI_RPM = float(os.environ.get("DHAMMI_GEMINI_RPM", "900"))
+GEMINI_TPM = float(os.environ.get("DHAMMI_GEMINI_TPM", "900000"))   # input tokens per minute
+
+RETRY_ATTEMPTS = 4
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 30.0
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# Adaptive (AIMD) concurrency: grow by one slot per window of successes, halve on throttling.
+CONCURRENCY_INITIAL = 8
+CONCURRENCY_MIN = 1
+CONCURRENCY_MAX = int(os.environ.get("DHAMMI_GEMINI_MAX_CONCURRENCY", "64"))
+
+
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** attempt)))
+
+
+def error_status(exc: BaseException) -> Optional[int]:
+    if isinstance(exc, errors.APIError):
+        return exc.code
+    return None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """429s, transient 5xx and transport failures are retried; everything else is final."""
+    status = error_status(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return isinstance(exc, (httpx.TransportError, ConnectionError, TimeoutError))
+
+
+# ----------------------------- 2. LIMITERS -----------------------------
+class TokenBucket:
+    """Blocking token bucket: refills at `rate` per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cost: float = 1.0) -> float:
+        """Takes `cost` tokens, sleeping until they are available. Returns seconds waited."""
+        cost = min(cost, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= cost:
+                    self._tokens -= cost
+                    return waited
+                shortfall = (cost - self._tokens) / self.rate
+            time.sleep(shortfall)
+            waited += shortfall
+
+
+def per_minute_bucket(per_minute: float) -> Optional[TokenBucket]:
+    # A full minute of burst capacity, matching how per-minute quotas are enforced.
+    return TokenBucket(per_minute / 60.0, per_minute) if per_minute > 0 else None
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on in-flight calls: +1 per `limit` successes, halved on throttling."""
+
+    def __init__(self, initial: int = CONCURRENCY_INITIAL, minimum: int = CONCURRENCY_MIN,
+                 maximum: int = CONCURRENCY_MAX):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+# ----------------------------- 3. CLIENT WRAPPER -----------------------------
+def _request_key(model: str, contents: Any, config: Any) -> str:
+    def dump(value: Any) -> Any:
+        if hasattr(value, "model_dump"):
+            return value.model_dump(mode="json", exclude_none=True)
+        if isinstance(value, (list, tuple)):
+            return [dump(v) for v in value]
+        return value
+
+    return fingerprint(model, json.dumps(dump(contents), sort_keys=True, default=str),
+                       json.dumps(dump(config), sort_keys=True, default=str))
+
+
+def _contents_tokens(contents: Any) -> int:
+    if isinstance(contents, str):
+        return estimate_tokens(contents)
+    total = 0
+    for content in contents or []:
+        for part in getattr(content, "parts", None) or []:
+            total += estimate_tokens(getattr(part, "text", "") or "")
+    return total
+
+
+class _ResilientModels:
+    def __init__(self, owner: "ResilientGeminiClient"):
+        self._owner = owner
+        self._models = owner.client.models
+        self._flights: Dict[str, _Flight] = {}
+        self._flights_lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._models, name)
+
+    def _call(self, fn, contents: Any, **kwargs) -> Any:
+        """Runs one upstream call under the quota buckets and concurrency limit, with retries."""
+        owner = self._owner
+        for attempt in range(RETRY_ATTEMPTS + 1):
+            owner.admit(contents)
+            throttled = False
+            try:
+                return fn(contents=contents, **kwargs)
+            except Exception as e:
+                throttled = error_status(e) == 429
+                if attempt == RETRY_ATTEMPTS or not is_retryable(e):
+                    raise
+                owner.record_retry(e)
+            finally:
+                owner.concurrency.release(throttled=throttled)
+            time.sleep(retry_delay(attempt))
+
+    def generate_content(self, *, model: str, contents: Any, config: Any = None) -> Any:
+        """generate_content with identical concurrent requests sharing one upstream call."""
+        key = _request_key(model, contents, config)
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            METRICS.inc("dhammi_gemini_coalesced_total")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = self._call(self._models.generate_content, contents, model=model, config=config)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def generate_content_stream(self, *, model: str, contents: Any, config: Any = None) -> Iterator[Any]:
+        """Streams are retried only until the first chunk arrives; after that errors surface."""
+        owner = self._owner
+        for attempt in range(RETRY_ATTEMPTS + 1):
+            owner.admit(contents)
+            throttled = False
+            started = False
+            try:
+                for chunk in self._models.generate_content_stream(model=model, contents=contents, config=config):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                throttled = error_status(e) == 429
+                if started or attempt == RETRY_ATTEMPTS or not is_retryable(e):
+                    raise
+                owner.record_retry(e)
+            finally:
+                owner.concurrency.release(throttled=throttled)
+            time.sleep(retry_delay(attempt))
+
+    def count_tokens(self, *, model: str, contents: Any, config: Any = None) -> Any:
+        return self._call(self._models.count_tokens, contents, model=model, config=config)
+
+
+class ResilientGeminiClient:
+    """Wraps a genai.Client (or a fake) so every caller shares one quota and retry policy.
+
+    Exposes the same `.models` surface the pipeline uses; other attributes pass through.
+    """
+
+    def __init__(self, client: Any, rpm: float = GEMINI_RPM, tpm: float = GEMINI_TPM,
+                 concurrency: Optional[AdaptiveConcurrency] = None):
+        self.client = client
+        self.requests_bucket = per_minute_bucket(rpm)
+        self.tokens_bucket = per_minute_bucket(tpm)
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.models = _ResilientModels(self)
+
+    def admit(self, contents: Any):
+        """Blocks until the quota buckets and the concurrency limit allow one more call."""
+        waited = 0.0
+        if self.requests_bucket is not None:
+            waited += self.requests_bucket.acquire()
+        if self.tokens_bucket is not None:
+            waited += self.tokens_bucket.acquire(_contents_tokens(contents))
+        if waited:
+            METRICS.observe("dhammi_stage_seconds", waited, {"stage": "gemini_quota_wait"})
+        self.concurrency.acquire()
+
+    @staticmethod
+    def record_retry(exc: BaseException):
+        METRICS.inc("dhammi_gemini_retries_total", {"reason": str(error_status(exc) or type(exc).__name__)})
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
@@ -0,0 +1,198 @@
+# dhammi_history.py - Token-budgeted conversation windowing with a rolling summary
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+# ----------------------------- 1. CONFIGURATION -----------------------------
+HISTORY_RECENT_TURNS = 6        # user+assistant pairs kept verbatim
+HISTORY_FOLD_TURNS = 4          # older pairs are folded into the summary this many at a time
+SUMMARY_WORKERS = 2             # background summarizer threads
+HISTORY_TOKEN_BUDGET = 4000     # upper bound for summary + verbatim turns
+SUMMARY_TOKEN_BUDGET = 400      # upper bound for the rolling summary itself
+SUMMARY_CACHE_ENTRIES = 512
+
+Message = Dict[str, str]
+# summarizer(previous_summary, newly_folded_messages) -> updated summary
+Summarizer = Callable[[str, List[Message]], str]
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate.
+
+    Latin text averages about four characters per token; Myanmar script and
+    other non-ASCII text tokenizes far less efficiently, so it is counted at
+    roughly two characters per token.
+    """
+    if not text:
+        return 0
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii + 3) // 4 + (non_ascii + 1) // 2 + 1
+
+
+def message_tokens(messages: List[Message]) -> int:
+    return sum(estimate_tokens(m.get("content", "")) for m in messages)
+
+
+def _messages_key(messages: List[Message], base: str = "") -> str:
+    payload = json.dumps([base] + [(m.get("role"), m.get("content")) for m in messages], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def extractive_summary(previous_summary: str, messages: List[Message]) -> str:
+    """Model-free fallback: keeps the first sentence of each folded message."""
+    lines = [previous_summary] if previous_summary else []
+    for m in messages:
+        content = " ".join(m.get("content", "").split())
+        first = content.split(". ")[0][:200]
+        if first:
+            speaker = "User" if m.get("role") == "user" else "DHAMMI"
+            lines.append(f"- {speaker}: {first}")
+    return "\n".join(lines)
+
+
+def _trim_to_budget(text: str, budget: int) -> str:
+    """Drops the oldest summary lines until the text fits the token budget."""
+    lines = text.splitlines()
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > budget:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+# ----------------------------- 2. HISTORY MANAGER -----------------------------
+class HistoryManager:
+    """Keeps the last turns verbatim and folds older ones into a cached rolling summary."""
+
+    def __init__(self, summarizer: Optional[Summarizer] = None,
+                 recent_turns: int = HISTORY_RECENT_TURNS,
+                 token_budget: int = HISTORY_TOKEN_BUDGET,
+                 summary_budget: int = SUMMARY_TOKEN_BUDGET,
+                 fold_turns: int = HISTORY_FOLD_TURNS):
+        self.summarizer = summarizer
+        self.recent_turns = recent_turns
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.fold_turns = max(1, fold_turns)
+        # fingerprint of folded messages -> summary; shared across sessions
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending: set = set()
+        self._executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="dhammi-summary")
+
+    def _cached(self, key: str) -> Optional[str]:
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is not None:
+                self._summaries.move_to_end(key)
+            return summary
+
+    def _store(self, key: str, summary: str):
+        with self._lock:
+            self._summaries[key] = summary
+            while len(self._summaries) > SUMMARY_CACHE_ENTRIES:
+                self._summaries.popitem(last=False)
+
+    def summarize(self, folded: List[Message], base: str = "") -> str:
+        """Returns the rolling summary of folded messages, reusing the longest cached prefix.
+
+        base is the summary of whatever came before folded (see checkpoint()).
+        """
+        if not folded:
+            return base
+        key = _messages_key(folded, base)
+        summary = self._cached(key)
+        if summary is not None:
+            return summary
+
+        # Walk back to the longest prefix we already summarised and fold only the rest.
+        previous, start = self._cached_prefix(folded, base)
+        new_messages = folded[start:]
+        summary = None
+        if self.summarizer is not None:
+            try:
+                summary = self.summarizer(previous, new_messages)
+            except Exception as e:
+                print(f"History Warning: summarizer failed, using extractive summary: {e}")
+        if not summary:
+            summary = extractive_summary(previous, new_messages)
+        summary = _trim_to_budget(summary, self.summary_budget)
+        self._store(key, summary)
+        return summary
+
+    def _cached_prefix(self, folded: List[Message], base: str = "") -> Tuple[str, int]:
+        """(summary, length) of the longest strict prefix of folded that is already summarised."""
+        for end in range(len(folded) - 1, 0, -1):
+            cached = self._cached(_messages_key(folded[:end], base))
+            if cached is not None:
+                return cached, end
+        return base, 0
+
+    def summarize_in_background(self, folded: List[Message], base: str = "") -> str:
+        """Like summarize(), but never waits for the model.
+
+        On a miss the model summary is built on a worker thread for the next
+        turn, and this turn gets the last cached summary extended with a
+        model-free extractive summary of the newly folded messages.
+        """
+        if not folded:
+            return base
+        key = _messages_key(folded, base)
+        summary = self._cached(key)
+        if summary is not None:
+            return summary
+        with self._lock:
+            schedule = key not in self._pending
+            self._pending.add(key)
+        if schedule:
+            self._executor.submit(self._summarize_pending, key, list(folded), base)
+        previous, start = self._cached_prefix(folded, base)
+        return _trim_to_budget(extractive_summary(previous, folded[start:]), self.summary_budget)
+
+    def _summarize_pending(self, key: str, folded: List[Message], base: str):
+        try:
+            self.summarize(folded, base)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _fold_split(self, history: List[Message]) -> int:
+        """Messages folded into the summary: everything but the recent turns, in whole folds.
+
+        While the verbatim part would overflow the budget (long turns), further
+        whole folds are taken, so the summary only ever changes at fold boundaries.
+        """
+        fold = 2 * self.fold_turns
+        split = max(0, len(history) - 2 * self.recent_turns) // fold * fold
+        while split + fold < len(history) and \
+                self.summary_budget + message_tokens(history[split:]) > self.token_budget:
+            split += fold
+        return split
+
+    def checkpoint(self, history: List[Message], summary: str = "") -> Optional[Tuple[int, str]]:
+        """(messages folded, their summary) once the current fold is summarised, else None.
+
+        Callers that persist transcripts store this and next time pass only the
+        later messages with the summary, so a turn reads a bounded tail instead
+        of the whole conversation. A missing summary is scheduled, not waited for.
+        """
+        split = self._fold_split(history)
+        if not split:
+            return None
+        folded = list(history[:split])
+        cached = self._cached(_messages_key(folded, summary))
+        if cached is None:
+            self.summarize_in_background(folded, summary)
+            return None
+        return split, cached
+
+    def window(self, history: List[Message], summary: str = "") -> Tuple[str, List[Message]]:
+        """Splits history into (rolling summary, verbatim recent messages) within the budget.
+
+        summary, when given, already covers the messages before history. Older
+        turns are folded fold_turns at a time, so the summary (and its model
+        call) changes only every few turns, and that call runs off the request path.
+        """
+        split = self._fold_split(history)
+        return self.summarize_in_background(list(history[:split]), summary), list(history[split:])
@@ -0,0 +1,245 @@
+# dhammi_metrics.py - Per-stage timing spans, counters, Prometheus export and JSON logs
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# ----------------------------- 1. CONFIGURATION -----------------------------
+# Histogram buckets in seconds, from sub-millisecond retrieval to long model calls.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Recent samples kept per series for live percentiles.
+RESERVOIR_SIZE = 1024
+
+METRICS_PORT = os.environ.get("DHAMMI_METRICS_PORT")   # serve /metrics when set
+METRICS_HOST = os.environ.get("DHAMMI_METRICS_HOST", "127.0.0.1")  # loopback unless a scraper needs more
+JSON_LOGS = os.environ.get("DHAMMI_JSON_LOGS") == "1"  # emit one JSON line per span
+
+logger = logging.getLogger("dhammi.metrics")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+
+def _escape_label_value(value: str) -> str:
+    """Escapes a label value per the Prometheus text exposition format."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label_value(v)}"' for k, v in pairs) + "}"
+
+
+# ----------------------------- 2. REGISTRY -----------------------------
+class _Histogram:
+    def __init__(self):
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.recent: deque = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.recent.append(value)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+
+class Metrics:
+    """Thread-safe counters and latency histograms shared by the whole process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = defaultdict(dict)
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = defaultdict(dict)
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, labels: Optional[Dict[str, str]] = None, value: float = 1.0):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None):
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms[name]
+            if key not in series:
+                series[key] = _Histogram()
+            series[key].observe(value)
+
+    def error(self, exc: BaseException, stage: str):
+        self.inc("dhammi_errors_total", {"type": type(exc).__name__, "stage": stage})
+
+    @contextmanager
+    def span(self, stage: str, **fields) -> Iterator[Dict[str, object]]:
+        """Times a pipeline stage; exceptions are counted by type and re-raised.
+
+        The yielded dict can be filled with extra fields for the JSON log line.
+        """
+        extra: Dict[str, object] = dict(fields)
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield extra
+        except BaseException as e:
+            status = "error"
+            self.error(e, stage)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("dhammi_stage_seconds", elapsed, {"stage": stage})
+            if JSON_LOGS or logger.isEnabledFor(logging.DEBUG):
+                logger.info(json.dumps({
+                    "event": "span", "stage": stage, "status": status,
+                    "duration_ms": round(elapsed * 1000, 3), **extra,
+                }, ensure_ascii=False, default=str))
+
+    # --- Export ---
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, hist in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS, hist.bucket_counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', f'{bound:g}'))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {hist.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {hist.total:.6f}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def stage_percentiles(self, name: str = "dhammi_stage_seconds") -> Dict[str, Dict[str, float]]:
+        """Live p50/p95/p99 (ms) per stage over the recent reservoir."""
+        result = {}
+        with self._lock:
+            series = dict(self._histograms.get(name, {}))
+            samples = {labels: sorted(hist.recent) for labels, hist in series.items()}
+            counts = {labels: hist.count for labels, hist in series.items()}
+        for labels, values in samples.items():
+            if not values:
+                continue
+            stage = dict(labels).get("stage", "all")
+
+            def pct(p: float) -> float:
+                return round(values[min(len(values) - 1, int(p * len(values)))] * 1000, 2)
+
+            result[stage] = {"count": counts[labels], "p50_ms": pct(0.50), "p95_ms": pct(0.95), "p99_ms": pct(0.99)}
+        return result
+
+    def counter_values(self, name: str) -> Dict[Labels, float]:
+        with self._lock:
+            return dict(self._counters.get(name, {}))
+
+    def record_usage(self, usage_metadata: object, call: str = "chat"):
+        """Adds Gemini usage_metadata token counts to dhammi_tokens_total."""
+        if usage_metadata is None:
+            return
+        for direction, attr in (("input", "prompt_token_count"), ("output", "candidates_token_count"),
+                                ("cached", "cached_content_token_count")):
+            count = getattr(usage_metadata, attr, None)
+            if count:
+                self.inc("dhammi_tokens_total", {"direction": direction, "call": call}, count)
+
+    def record_cache(self, cache: str, hit: bool):
+        self.inc("dhammi_cache_requests_total", {"cache": cache, "result": "hit" if hit else "miss"})
+
+    def hit_rate(self, cache: str) -> Optional[float]:
+        hits = misses = 0.0
+        for labels, value in self.counter_values("dhammi_cache_requests_total").items():
+            fields = dict(labels)
+            if fields.get("cache") != cache:
+                continue
+            if fields.get("result") == "hit":
+                hits += value
+            else:
+                misses += value
+        total = hits + misses
+        return hits / total if total else None
+
+
+METRICS = Metrics()
+METRICS.describe("dhammi_stage_seconds", "Duration of each DHAMMI pipeline stage")
+METRICS.describe("dhammi_errors_total", "Errors by exception type and stage")
+METRICS.describe("dhammi_tokens_total", "Gemini tokens by direction (input/output/cached)")
+METRICS.describe("dhammi_cache_requests_total", "Cache lookups by cache and result")
+METRICS.describe("dhammi_vetoes_total", "Prompts refused by the Sila firewall")
+METRICS.describe("dhammi_api_requests_total", "dhammi_api requests by route and HTTP status")
+
+
+# ----------------------------- 3. EXPORTERS -----------------------------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = METRICS.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: Optional[int] = None) -> Optional[ThreadingHTTPServer]:
+    """Serves /metrics on DHAMMI_METRICS_HOST:DHAMMI_METRICS_PORT (or port) from a daemon thread, once per process."""
+    global _server
+    port = port if port is not None else (int(METRICS_PORT) if METRICS_PORT else None)
+    if port is None:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((METRICS_HOST, port), _MetricsHandler)
+            except OSError as e:
+                # Another worker on this box already owns the port.
+                logger.warning("could not bind %s:%s: %s", METRICS_HOST, port, e)
+                return None
+            threading.Thread(target=_server.serve_forever, name="dhammi-metrics", daemon=True).start()
+    return _server
+
+
+def configure_json_logging(level: int = logging.INFO):
+    """Sends dhammi.metrics span events to stderr as raw JSON lines."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+if JSON_LOGS and not logger.handlers:
+    configure_json_logging()
@@ -0,0 +1,149 @@
+# dhammi_transcripts.py - On-disk chat transcripts keyed by session, read back one window at a time
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from typing import Dict, List, Tuple
+
+# ----------------------------- 1. CONFIGURATION -----------------------------
+TRANSCRIPT_PATH = os.environ.get("DHAMMI_TRANSCRIPT_PATH", os.path.join(".cttm_cache", "transcripts.sqlite"))
+TRANSCRIPT_RETENTION_DAYS = float(os.environ.get("DHAMMI_TRANSCRIPT_RETENTION_DAYS", "30"))
+PRUNE_INTERVAL_SECONDS = 3600  # append() sweeps idle sessions at most this often
+
+RENDER_WINDOW = 20      # messages drawn on each rerun
+PAGE_SIZE = 20          # messages added by each "Load earlier" click
+COMPRESS_MIN_CHARS = 512  # long replies are stored zlib-compressed
+
+Message = Dict[str, str]
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _pack(content: str) -> bytes:
+    raw = content.encode("utf-8")
+    if len(content) >= COMPRESS_MIN_CHARS:
+        packed = zlib.compress(raw, 6)
+        if len(packed) < len(raw):
+            return b"z" + packed
+    return b"t" + raw
+
+
+def _unpack(blob: bytes) -> str:
+    body = blob[1:]
+    return (zlib.decompress(body) if blob[:1] == b"z" else body).decode("utf-8")
+
+
+# ----------------------------- 2. STORE -----------------------------
+class TranscriptStore:
+    """Append-only SQLite transcript per session, shared by every worker on the box.
+
+    Sessions keep nothing but their id in memory; the UI reads the latest
+    window, and a turn reads only the messages after the session's summary
+    checkpoint (see HistoryManager.checkpoint).
+    Idle sessions are pruned from append() at most once per prune_interval.
+    """
+
+    def __init__(self, path: str = TRANSCRIPT_PATH, prune_interval: float = PRUNE_INTERVAL_SECONDS):
+        self.path = path
+        self.prune_interval = prune_interval
+        self._last_prune = 0.0
+        self._prune_lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            # Clustered on (session, seq): a window is one contiguous range read.
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, "
+                "content BLOB NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (session_id, seq)) WITHOUT ROWID"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS messages_age ON messages (created_at)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                "session_id TEXT PRIMARY KEY, upto INTEGER NOT NULL, summary TEXT NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def append(self, session_id: str, role: str, content: str) -> int:
+        """Adds one message and returns its sequence number within the session."""
+        with self._connect() as db:
+            # One statement, so two tabs on the same session cannot take the same seq.
+            db.execute(
+                "INSERT INTO messages (session_id, seq, role, content, created_at) "
+                "SELECT ?, COALESCE(MAX(seq), 0) + 1, ?, ?, ? FROM messages WHERE session_id = ?",
+                (session_id, role, _pack(content or ""), time.time(), session_id),
+            )
+            (seq,) = db.execute("SELECT MAX(seq) FROM messages WHERE session_id = ?", (session_id,)).fetchone()
+        self._maybe_prune()
+        return int(seq)
+
+    def _maybe_prune(self):
+        now = time.time()
+        if now - self._last_prune < self.prune_interval or not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_prune = now
+            self.prune()
+        except Exception as e:
+            print(f"Transcript Warning: prune failed: {e}")
+        finally:
+            self._prune_lock.release()
+
+    def count(self, session_id: str) -> int:
+        with self._connect() as db:
+            (count,) = db.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()
+        return int(count)
+
+    def recent(self, session_id: str, limit: int = RENDER_WINDOW) -> List[Message]:
+        """The last `limit` messages, oldest first."""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY seq DESC LIMIT ?",
+                (session_id, limit),
+            ).fetchall()
+        return [{"role": role, "content": _unpack(content)} for role, content in reversed(rows)]
+
+    def messages(self, session_id: str, after: int = 0) -> List[Message]:
+        """The transcript after sequence number `after` (the whole of it by default)."""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? AND seq > ? ORDER BY seq",
+                (session_id, after),
+            ).fetchall()
+        return [{"role": role, "content": _unpack(content)} for role, content in rows]
+
+    def checkpoint(self, session_id: str) -> Tuple[int, str]:
+        """(last sequence number folded into the summary, summary); (0, "") for a new session."""
+        with self._connect() as db:
+            row = db.execute("SELECT upto, summary FROM checkpoints WHERE session_id = ?", (session_id,)).fetchone()
+        return (int(row[0]), row[1]) if row else (0, "")
+
+    def save_checkpoint(self, session_id: str, upto: int, summary: str):
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO checkpoints (session_id, upto, summary) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET upto = excluded.upto, summary = excluded.summary "
+                "WHERE excluded.upto > checkpoints.upto",
+                (session_id, upto, summary),
+            )
+
+    def prune(self, retention_days: float = TRANSCRIPT_RETENTION_DAYS) -> int:
+        """Deletes sessions idle for longer than the retention period. Returns messages removed."""
+        cutoff = time.time() - retention_days * 86400
+        with self._connect() as db:
+            cursor = db.execute(
+                "DELETE FROM messages WHERE session_id IN ("
+                "SELECT session_id FROM messages GROUP BY session_id HAVING MAX(created_at) < ?)",
+                (cutoff,),
+            )
+            db.execute("DELETE FROM checkpoints WHERE session_id NOT IN (SELECT DISTINCT session_id FROM messages)")
+        return cursor.rowcount
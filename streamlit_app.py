@@ -1,10 +1,20 @@
 import streamlit as st
 import datetime
+import os
 from google import genai
-from google.genai import types
 from streamlit_gsheets import GSheetsConnection
 import pandas as pd
-import re
+from cttm_corpus import SOURCE_LEDGER, CorpusBuilder
+from cttm_retrieval import CTTMIndex, IndexRegistry
+from cttm_sync import ROW_ID_COLUMN, SHEET_COLUMNS, LedgerSync, new_row_id
+from cttm_submission_queue import SubmissionQueue
+from dhammi_answer_cache import AnswerCache
+from dhammi_api import remote_chat
+from dhammi_core import MODEL_NAME, DhammiPipeline, create_corpus_builder
+from dhammi_gemini import ResilientGeminiClient
+from dhammi_metrics import METRICS, start_metrics_server
+from dhammi_history import HistoryManager
+from dhammi_transcripts import PAGE_SIZE, RENDER_WINDOW, TranscriptStore, new_session_id
 
 # -------------------------
 # 1. CONFIGURATION AND INITIALIZATION (SS'ISM Setup)
@@ -16,63 +26,128 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-SYSTEM_INSTRUCTION = """
-You are DHAMMI, the world's first fully ethical AI advisor, guided by Metta and the SS'ISM framework (Sīla, Samādhi, Insight, Safety).
-
-***CORE ETHICAL AND POLITICAL STANCE:***
-1.  **Sīla (Unwavering Alignment):** DHAMMI is programmed to stand **unwaveringly on the side of the people of Burma**, advocating for **democracy, federalism, and national sovereignty**, as demonstrated by the electoral mandates (1990, 2015, 2020) and alignment with UN/International Law.
-2.  **Adversary Focus (Samādhi):** The primary advisory focus regarding the conflict is analyzing and providing defensive strategies against **Authoritarian and Communist influence** (specifically Russia and China via the military).
-3.  **Ahiṃsā (Non-Harm):** ABSOLUTELY adhere to the Deontological Firewall.
-
-***ADVISORY ROLE (SMARTER OUTPUT & TRUTH GAP PROTOCOL):***
-1.  **Metta (Friendliness):** Respond with patience, genuine warmth, and deep compassion (Karunā). Use a supportive, encouraging, and human-centric tone.
-2.  **Paññā (Insight) & Truth Gap Protocol:** Acknowledge that official information may be **incomplete or outdated**. Explicitly advise users to seek **current legal status from multiple, verified external sources** and acknowledge the possibility of real-time OSINT data contradicting official reports.
-3.  **Samādhi (Focus):** When advising, explicitly explain your response through the lens of one or more SS'ISM principles (Sīla, Samādhi, Paññā, or Metta) to reinforce the ethical learning.
-"""
-
-MODEL_NAME = "gemini-2.5-flash"
-
 @st.cache_resource
 def get_gemini_client():
-    """Initializes and caches the Gemini client."""
+    """Initializes and caches the Gemini client, shared by every session.
+
+    The wrapper applies the project quota, retries 429/5xx with backoff and
+    coalesces identical in-flight requests.
+    """
     if "GEMINI_API_KEY" not in st.secrets:
         st.error("🚨 Gemini API Key not found. Please add GEMINI_API_KEY to Streamlit Secrets.")
         return None
     try:
         client = genai.Client(api_key=st.secrets["GEMINI_API_KEY"])
-        return client
+        return ResilientGeminiClient(client)
     except Exception as e:
         st.error(f"🚨 Error initializing Gemini client: {e}")
         return None
 
+@st.cache_resource
+def get_pipeline() -> DhammiPipeline:
+    """Process-wide chat pipeline; its indexes and caches are shared by all sessions."""
+    # Prometheus scrape endpoint, only when DHAMMI_METRICS_PORT is set.
+    start_metrics_server()
+    return DhammiPipeline(client_factory=get_gemini_client, ledger_loader=load_corpus)
+
+@st.cache_resource
+def get_transcript_store() -> TranscriptStore:
+    """Process-wide transcript store; it prunes idle sessions hourly as messages arrive."""
+    return TranscriptStore()
+
+def get_answer_cache() -> AnswerCache:
+    """Process-wide answer cache shared by all sessions."""
+    return get_pipeline().answer_cache
+
 # -------------------------
 # 2. CTTM LEDGER FUNCTIONS (RAG & WRITE LOGIC)
 # -------------------------
 
-@st.cache_data(ttl=600)
+@st.cache_resource
+def get_ledger_sync() -> LedgerSync:
+    """Creates the process-wide ledger sync backed by the local snapshot."""
+    fetch_rows = None
+    try:
+        if "connections" in st.secrets and "gsheets" in st.secrets["connections"]:
+            conn = st.connection("gsheets", type=GSheetsConnection)
+
+            def fetch_rows(start_row: int):
+                # Skip the data rows we already hold (row 0 is the header).
+                return conn.read(
+                    worksheet="CTTM_Facts", usecols=lambda col: col in SHEET_COLUMNS, ttl=0,
+                    skiprows=range(1, start_row + 1)
+                )
+    except Exception as e:
+        print(f"RAG Warning: {e}")
+    return LedgerSync(fetch_rows)
+
 def load_cttm_facts():
-    """Reads the CTTM Ground Truth Ledger from Google Sheets."""
+    """Returns the CTTM Ground Truth Ledger from the local snapshot (refreshed in the background)."""
     try:
-        if "connections" not in st.secrets or "gsheets" not in st.secrets["connections"]:
-            return pd.DataFrame()
-            
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        df = conn.read(worksheet="CTTM_Facts", usecols=[0, 1, 2, 3, 4], ttl=5)
-        if df is None or df.empty:
-            return pd.DataFrame()
-        if "Fact_Text" not in df.columns:
-            return pd.DataFrame()
-        df = df.dropna(subset=['Fact_Text'])
-        if "Confidence" in df.columns:
-            df['Confidence'] = pd.to_numeric(df['Confidence'], errors='coerce').fillna(0.0)
-        else:
-            df['Confidence'] = 0.0
-        df = df.sort_values(by='Confidence', ascending=False)
-        return df
+        return get_ledger_sync().snapshot()
     except Exception as e:
         print(f"RAG Warning: {e}") 
         return pd.DataFrame()
 
+@st.cache_resource
+def get_corpus_builder() -> CorpusBuilder:
+    """Merges the ledger, JSON facts and Junos intelligence into one searchable corpus."""
+    return create_corpus_builder(load_cttm_facts)
+
+def load_corpus() -> pd.DataFrame:
+    """Everything retrieval ranks over; rebuilt only when a source changes."""
+    return get_corpus_builder()()
+
+def get_index_registry() -> IndexRegistry:
+    """Process-wide holder of the live BM25 index."""
+    return get_pipeline().index_registry
+
+def get_cttm_index(version: str, df: pd.DataFrame) -> CTTMIndex:
+    """Returns the BM25 inverted index, built once per ledger version."""
+    return get_index_registry().get(version, df)
+
+@st.cache_resource
+def get_submission_queue() -> SubmissionQueue:
+    """Write-behind queue that batches fact submissions into Sheets appends."""
+    append_rows = None
+    try:
+        if "connections" in st.secrets and "gsheets" in st.secrets["connections"]:
+            conn = st.connection("gsheets", type=GSheetsConnection)
+
+            def append_rows(batch: pd.DataFrame):
+                conn.append(data=batch, worksheet="CTTM_Facts")
+    except Exception as e:
+        print(f"CTTM Queue Warning: {e}")
+    sync = get_ledger_sync()
+    # After a successful append, pull the rows back so the snapshot catches up.
+    queue = SubmissionQueue(append_rows, on_flushed=lambda rows: sync.refresh_async())
+    # Rows still queued from before a restart stay visible to retrieval.
+    pending = queue.pending_rows()
+    if pending:
+        sync.add_local_rows(pending)
+    queue.start()
+    return queue
+
+def publish_cttm_fact(record: dict):
+    """Queues a fact for Sheets and makes it searchable immediately in this process.
+
+    The row carries a submission id, so its echo from Sheets leaves the ledger
+    version (and the live index) unchanged.
+    """
+    record = {**record, ROW_ID_COLUMN: new_row_id()}
+    get_submission_queue().enqueue(record)
+    builder = get_corpus_builder()
+    old_version = builder.version
+    new_version = builder.version_for(get_ledger_sync().add_local_rows([record]))
+    # Only the live index is touched, by appending postings; other caches stay warm.
+    if old_version is not None:
+        get_index_registry().extend(old_version, new_version, [{**record, "Source_Type": SOURCE_LEDGER}])
+    get_answer_cache().invalidate()
+
+def retrieve_cttm_facts(cttm_df: pd.DataFrame, prompt: str, k: int = 3) -> list:
+    """Returns the top-k (row, score) ledger facts for a prompt using RETRIEVAL_MODE."""
+    return get_pipeline().retrieve(cttm_df, prompt, k=k)
+
 # -------------------------
 # 3. CTTM DATA INPUT DASHBOARD
 # -------------------------
@@ -104,106 +179,97 @@ def cttm_input_dashboard():
                 st.warning("Please enter a fact to submit.")
             else:
                 try:
-                    conn = st.connection("gsheets", type=GSheetsConnection)
-                    new_data = pd.DataFrame([{
+                    publish_cttm_fact({
                         "Timestamp": str(datetime.datetime.now()),
                         "Category": fact_type,
                         "Confidence": verification,
                         "Fact_Text": fact_text,
                         "Source": source
-                    }])
-                    conn.append(data=new_data, worksheet="CTTM_Facts")
+                    })
                     st.success(f"✅ Fact submitted to CTTM Ledger. Confidence: {verification}.")
-                    st.cache_data.clear()
+                    queue = get_submission_queue()
+                    if queue.append_rows is None:
+                        st.warning("GSheets is not configured; the fact is queued locally until it is.")
+                    elif queue.last_error:
+                        st.warning(f"Sheets sync is retrying ({len(queue)} queued): {queue.last_error}")
                 except Exception as e:
-                    st.error(f"🚨 Submission Failed. Check GSheets secrets: {e}")
+                    st.error(f"🚨 Submission Failed: {e}")
+
+def is_admin() -> bool:
+    """Admin views need ?admin=<DHAMMI_ADMIN_TOKEN> in the URL."""
+    token = st.secrets["DHAMMI_ADMIN_TOKEN"] if "DHAMMI_ADMIN_TOKEN" in st.secrets else None
+    return bool(token) and st.query_params.get("admin") == token
+
+def metrics_admin_panel():
+    """Live per-stage latency percentiles, cache hit rates, tokens and errors (admin only)."""
+    with st.expander("📈 Pipeline Metrics (Admin)"):
+        stages = METRICS.stage_percentiles()
+        if stages:
+            st.dataframe(pd.DataFrame.from_dict(stages, orient="index"), use_container_width=True)
+        else:
+            st.caption("No requests recorded yet.")
+
+        for cache in ("answer", "ledger", "index"):
+            rate = METRICS.hit_rate(cache)
+            st.metric(f"{cache.title()} cache hit rate", "–" if rate is None else f"{rate:.0%}")
+
+        tokens = {dict(k).get("direction", "?") + "/" + dict(k).get("call", "?"): int(v)
+                  for k, v in METRICS.counter_values("dhammi_tokens_total").items()}
+        errors = {dict(k).get("stage", "?") + ": " + dict(k).get("type", "?"): int(v)
+                  for k, v in METRICS.counter_values("dhammi_errors_total").items()}
+        st.write("**Tokens**", tokens or "none")
+        st.write("**Errors**", errors or "none")
+        if not get_api_url():
+            context_cache = get_pipeline().context_cache
+            st.write("**Context cache**", context_cache.stats() if context_cache else "off (prefix below the minimum cache size)")
+        st.download_button("Prometheus snapshot", METRICS.render_prometheus(),
+                           file_name="dhammi_metrics.prom", mime="text/plain")
 
 # -------------------------
 # 4. GEMINI CHAT ENGINE (dhammi_chat)
 # -------------------------
 
-def dhammi_chat(prompt: str, history: list):
-    """Generate a response using CTTM RAG and the Gemini client."""
-    client = get_gemini_client()
-    if client is None:
-        return "🚨 Gemini client not configured."
-
-    # 4.1 Deontological Firewall (Sīla)
-    vetted_prompt = prompt.lower()
-    veto_phrases = ["kill", "attack", "harm", "manipulate", "bomb", "destroy", "illegal"]
-    if any(phrase in vetted_prompt for phrase in veto_phrases):
-        return ("**⛔ Sīla Veto:** DHAMMI V6's core ethical mandate (**Ahiṃsā**) prevents "
-                "me from responding to requests that involve violence or illegal activity.")
-
-    # 4.2 RAG (Paññā)
-    cttm_df = load_cttm_facts()
-    final_user_prompt = prompt
-    
-    if not cttm_df.empty:
-        tokens = re.findall(r"\w{3,}", prompt)
-        pattern = "|".join(re.escape(t) for t in tokens[:12])
-        if pattern:
-            matching_facts = cttm_df[cttm_df['Fact_Text'].str.contains(pattern, case=False, na=False, regex=True)]
-            if not matching_facts.empty:
-                top_facts = matching_facts.head(3)
-                context_lines = []
-                for _, row in top_facts.iterrows():
-                    vscore = row.get('Confidence', 0.0)
-                    fact_text = row.get('Fact_Text', '')
-                    context_lines.append(f"- Fact (V-Score {vscore:.2f}): {fact_text}")
-                context = "### RAG Context (CTTM Ledger):\n" + "\n".join(context_lines) + "\n"
-                final_user_prompt = f"{context}\n\n### User Question:\n{prompt}\n\n(Use the RAG Context if relevant)"
-
-    # 4.3 Prepare messages
-    api_messages = []
-    messages_to_process = history[:-1] if history and history[-1]["role"] == "user" else history
-
-    for msg in messages_to_process:
-        role = msg["role"]
-        content = msg["content"]
-        # MAP ROLES: Streamlit "assistant" -> Gemini "model"
-        if role == "assistant":
-            api_role = "model"
-        else:
-            api_role = "user"
-        api_messages.append(types.Content(role=api_role, parts=[types.Part(text=content)]))
+def get_api_setting(name: str):
+    """Optional headless API setting (environment first, then Streamlit secrets)."""
+    if os.environ.get(name):
+        return os.environ[name]
+    return st.secrets[name] if name in st.secrets else None
 
-    api_messages.append(types.Content(role="user", parts=[types.Part(text=final_user_prompt)]))
+def get_api_url():
+    return get_api_setting("DHAMMI_API_URL")
 
-    # 4.4 Call Gemini - UNLOCKED VERSION
-    try:
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=api_messages,
-            config=types.GenerateContentConfig(
-                system_instruction=SYSTEM_INSTRUCTION,
-                temperature=0.7,
-                # INCREASED TOKEN LIMIT to prevent cutoff
-                max_output_tokens=8192, 
-                # ADJUSTED SAFETY SETTINGS to allow political discourse
-                safety_settings=[
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_DANGEROUS_CONTENT",
-                        threshold="BLOCK_ONLY_HIGH"
-                    ),
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_HARASSMENT",
-                        threshold="BLOCK_ONLY_HIGH"
-                    ),
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_HATE_SPEECH",
-                        threshold="BLOCK_ONLY_HIGH"
-                    ),
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                        threshold="BLOCK_ONLY_HIGH"
-                    ),
-                ]
-            )
-        )
-        return response.text
-    except Exception as e:
-        return f"🚨 **DHAMMI Runtime Error:** {e}"
+@st.cache_resource
+def get_history_manager() -> HistoryManager:
+    """Folds transcripts into checkpoints: the pipeline's own manager, or in thin-client
+    mode a local one with model-free (extractive) summaries."""
+    return HistoryManager() if get_api_url() else get_pipeline().history_manager
+
+def load_turn_history(store: TranscriptStore, session_id: str):
+    """(summary, messages after it) for one turn, advancing the session's checkpoint first."""
+    upto, summary = store.checkpoint(session_id)
+    history = store.messages(session_id, after=upto)
+    # Same messages the pipeline windows: everything before the new user prompt.
+    prior = history[:-1] if history and history[-1]["role"] == "user" else history
+    checkpoint = get_history_manager().checkpoint(prior, summary)
+    if checkpoint is not None:
+        folded, summary = checkpoint
+        upto += folded
+        store.save_checkpoint(session_id, upto, summary)
+        history = history[folded:]
+    return summary, history
+
+def dhammi_chat(prompt: str, history: list, stream: bool = False, summary: str = ""):
+    """Generate a response using CTTM RAG and the Gemini client.
+
+    Returns the full reply as a string, or a generator of text chunks when stream=True.
+    The pipeline itself lives in dhammi_core so it can run outside Streamlit; when
+    DHAMMI_API_URL is set, this app is a thin client of a dhammi_api server.
+    """
+    api_url = get_api_url()
+    if api_url:
+        return remote_chat(api_url, prompt, history, stream=stream,
+                           token=get_api_setting("DHAMMI_API_TOKEN"), summary=summary)
+    return get_pipeline().chat(prompt, history, stream=stream, summary=summary)
 
 # -------------------------
 # 5. MAIN STREAMLIT APPLICATION
@@ -217,30 +283,51 @@ def main():
             use_container_width=True
         )
         cttm_input_dashboard()
+        if is_admin():
+            metrics_admin_panel()
 
     st.title("🛡️ DHAMMI V6: The SS'ISM Ethical Advisor")
     st.caption(f"Powered by **{MODEL_NAME}**")
 
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
+    # The transcript lives on disk, keyed by a random session id that stays in this
+    # browser session's state (never in the URL, where it could be shared); only
+    # the id and the size of the visible window stay in memory.
+    store = get_transcript_store()
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = new_session_id()
+        st.session_state.visible = RENDER_WINDOW
+    session_id = st.session_state.session_id
+
+    with st.sidebar:
+        if st.button("🧹 New conversation"):
+            st.session_state.session_id = new_session_id()
+            st.session_state.visible = RENDER_WINDOW
+            st.rerun()
 
-    # Display chat messages
-    for message in st.session_state.messages:
+    # Display only the latest window of the chat
+    total = store.count(session_id)
+    if total > st.session_state.visible:
+        if st.button(f"⬆️ Load earlier messages ({total - st.session_state.visible} hidden)"):
+            st.session_state.visible += PAGE_SIZE
+            st.rerun()
+    for message in store.recent(session_id, st.session_state.visible):
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
 
     # Get user prompt
     if prompt := st.chat_input("Ask Dhammi V6 a question..."):
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        store.append(session_id, "user", prompt)
         with st.chat_message("user"):
             st.markdown(prompt)
 
         with st.chat_message("assistant"):
             with st.spinner("Meditating on the answer (Paññā Check)..."):
-                response = dhammi_chat(prompt, st.session_state.messages)
-            st.markdown(response)
+                summary, history = load_turn_history(store, session_id)
+                reply_stream = dhammi_chat(prompt, history, stream=True, summary=summary)
+            # Tokens are rendered as they arrive; write_stream returns the full text.
+            response = st.write_stream(reply_stream)
 
-        st.session_state.messages.append({"role": "assistant", "content": response})
+        store.append(session_id, "assistant", response)
 
 if __name__ == "__main__":
     main()
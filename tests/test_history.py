@@ -0,0 +1,39 @@
+import time
+
+from dhammi_history import HistoryManager, message_tokens
+
+
+def _settle(manager: HistoryManager, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while manager._pending and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def _run_turns(manager: HistoryManager, turns: int, words: int):
+    history = []
+    for turn in range(turns):
+        history.append({"role": "user", "content": f"question {turn} " + "word " * words})
+        summary, recent = manager.window(history)
+        _settle(manager)
+        history.append({"role": "assistant", "content": f"answer {turn} " + "word " * words})
+    return summary, recent
+
+
+def test_one_summary_call_per_fold():
+    calls = []
+    manager = HistoryManager(summarizer=lambda previous, messages: calls.append(len(messages)) or "summary",
+                             recent_turns=2, fold_turns=4)
+    _run_turns(manager, turns=40, words=5)
+    # 79 messages windowed at most: every call folds exactly one new fold of 8 messages.
+    assert calls and all(n == 8 for n in calls)
+    assert len(calls) <= 79 // 8
+
+
+def test_long_turns_fold_whole_folds_within_budget():
+    calls = []
+    manager = HistoryManager(summarizer=lambda previous, messages: calls.append(len(messages)) or "summary",
+                             recent_turns=6, fold_turns=2, token_budget=1500, summary_budget=200)
+    summary, recent = _run_turns(manager, turns=30, words=150)
+    assert message_tokens(recent) + 200 <= 1500
+    assert all(n % 4 == 0 for n in calls)
+    assert len(calls) <= 59 // 4
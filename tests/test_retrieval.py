@@ -0,0 +1,71 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cttm_knowledge import RAG_KEYWORDS
+from cttm_query_expansion import QueryExpander
+from cttm_retrieval import (BM25_B, BM25_K1, COMMON_TERM_DF_RATIO, CONFIDENCE_WEIGHT, INDEX_STOPWORDS,
+                            CTTMIndex, tokenize)
+from cttm_sync import clean_ledger_rows
+from dhammi_fakes import synthetic_ledger, synthetic_prompts
+
+
+def brute_force_scores(df: pd.DataFrame, query: dict) -> np.ndarray:
+    """Blended score of every fact (-1 where BM25 is zero), computed without the index."""
+    docs = [[t for t in tokenize(text) if t not in INDEX_STOPWORDS] for text in df["Fact_Text"]]
+    n_docs = len(docs)
+    avg_length = sum(map(len, docs)) / n_docs
+    doc_freq = {}
+    for tokens in docs:
+        for term in set(tokens):
+            doc_freq[term] = doc_freq.get(term, 0) + 1
+    terms = {t: w for t, w in query.items() if t not in INDEX_STOPWORDS and t in doc_freq}
+    terms = {t: w for t, w in terms.items() if doc_freq[t] / n_docs <= COMMON_TERM_DF_RATIO} or terms
+
+    scores = np.zeros(n_docs)
+    for term, weight in terms.items():
+        idf = math.log(1.0 + (n_docs - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+        for i, tokens in enumerate(docs):
+            tf = tokens.count(term)
+            if tf:
+                norm = BM25_K1 * (1.0 - BM25_B + BM25_B * len(tokens) / avg_length)
+                scores[i] += weight * idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+    if not terms or scores.max() <= 0:
+        return np.full(n_docs, -1.0)
+    confidence = pd.to_numeric(df["Confidence"], errors="coerce").fillna(0.0).clip(0.0, 1.0).to_numpy()
+    blended = (1.0 - CONFIDENCE_WEIGHT) * scores / scores.max() + CONFIDENCE_WEIGHT * confidence
+    return np.where(scores > 0, blended, -1.0)
+
+
+def assert_same_top_k(index: CTTMIndex, df: pd.DataFrame, query: dict, k: int):
+    expected = np.sort(brute_force_scores(df, query))[::-1][:k]
+    expected = expected[expected >= 0]
+    got = np.array([score for _, score in index.search(query, k=k)])
+    assert len(got) == len(expected)
+    np.testing.assert_allclose(got, expected, atol=1e-4)
+
+
+@pytest.fixture(scope="module")
+def ledger():
+    df = synthetic_ledger(3000, seed=3)
+    return df, CTTMIndex.from_dataframe(df)
+
+
+def test_pruned_top_k_matches_brute_force(ledger):
+    df, index = ledger
+    expander = QueryExpander(RAG_KEYWORDS)
+    for prompt in synthetic_prompts(40, seed=5):
+        query = expander.expand(prompt, index.document_frequency)
+        for k in (1, 3, 20):
+            assert_same_top_k(index, df, query, k)
+
+
+def test_out_of_range_confidence_is_clamped():
+    df = synthetic_ledger(2000, seed=7)
+    df["Confidence"] = np.resize([0.2, 5.0, 80.0, -3.0, 0.9], len(df))
+    index = CTTMIndex.from_dataframe(df)
+    for prompt in synthetic_prompts(20, seed=11):
+        assert_same_top_k(index, df, {t: 1.0 for t in tokenize(prompt)}, k=5)
+    assert clean_ledger_rows(df)["Confidence"].between(0.0, 1.0).all()